@@ -0,0 +1,140 @@
+#!/usr/bin/python
+
+# Copyright The OpenTelemetry Authors
+# SPDX-License-Identifier: Apache-2.0
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger('main')
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    At most one call of fn per key at a time: callers that arrive while it
+    is running wait for it and share its result (or exception) instead of
+    starting their own.
+    """
+
+    def __init__(self, on_coalesced=None):
+        # Called with the key for every caller that waited on another's call
+        self._on_coalesced = on_coalesced or (lambda key: None)
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            self._on_coalesced(key)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class CatalogCache:
+    """
+    Product ID cache in front of ProductCatalogService.ListProducts.
+
+    Within `ttl` seconds of the last fetch the cached IDs are returned as
+    is. Up to `stale_ttl` seconds after that they are still returned, while
+    a single background refresh fetches new ones (stale-while-revalidate),
+    so callers only wait for the catalog when the cache is empty or very
+    old. IDs are deduplicated and capped at `max_ids`.
+
+    Concurrent fetches (misses and the background refresh) are coalesced
+    into one ListProducts call; `on_coalesced` is called for each caller
+    that joined another's fetch.
+    """
+
+    def __init__(self, fetch, ttl=30.0, stale_ttl=300.0, max_ids=10000, on_lookup=None,
+                 on_coalesced=None):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_ids = max_ids
+        # Called with "hit", "stale" or "miss" for every get()
+        self._on_lookup = on_lookup or (lambda result: None)
+
+        self._ids = ()
+        self._fetched_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._flight = SingleFlight(on_coalesced)
+
+    def _fetch_and_store(self):
+        # dict.fromkeys keeps the catalog order while dropping duplicates
+        unique = tuple(dict.fromkeys(self._fetch()))[:self.max_ids]
+        with self._lock:
+            self._ids = unique
+            self._fetched_at = time.monotonic()
+        return unique
+
+    def refresh(self):
+        """Fetch the catalog now (or join a fetch in progress) and cache the IDs."""
+        return self._flight.do("ListProducts", self._fetch_and_store)
+
+    def warm_up(self):
+        """Fill the cache before serving; a failure only means a cold start."""
+        try:
+            ids = self.refresh()
+            logger.info(f"Catalog cache warmed up with {len(ids)} products")
+        except Exception as e:
+            logger.warning(f"Catalog cache warm-up failed: {e}")
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            # Keep serving the stale IDs; the next get() will try again
+            logger.warning(f"Catalog cache refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get(self):
+        with self._lock:
+            ids, fetched_at = self._ids, self._fetched_at
+            age = time.monotonic() - fetched_at if fetched_at is not None else None
+            stale = age is not None and self.ttl <= age < self.ttl + self.stale_ttl
+            start_refresh = stale and not self._refreshing
+            if start_refresh:
+                self._refreshing = True
+
+        if age is not None and age < self.ttl:
+            self._on_lookup("hit")
+            return ids
+        if stale:
+            if start_refresh:
+                threading.Thread(target=self._refresh_in_background, daemon=True).start()
+            self._on_lookup("stale")
+            return ids
+
+        self._on_lookup("miss")
+        return self.refresh()
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+
+# Copyright The OpenTelemetry Authors
+# SPDX-License-Identifier: Apache-2.0
+
+import logging
+import threading
+import time
+
+from openfeature import api
+from openfeature.event import ProviderEvent
+
+logger = logging.getLogger('main')
+
+
+class FlagSnapshot:
+    """
+    In-process copy of boolean feature flags so request handlers evaluate
+    them with a dictionary lookup instead of a call to flagd.
+
+    A background thread re-evaluates every flag through the OpenFeature
+    client each `refresh_interval` seconds, and immediately when flagd's
+    event stream reports a configuration change. A flag that fails to
+    evaluate keeps its previous value, so the snapshot goes stale instead
+    of silently falling back to defaults.
+    """
+
+    def __init__(self, defaults, refresh_interval=30.0, on_evaluated=None):
+        self.defaults = dict(defaults)
+        self.refresh_interval = refresh_interval
+        # Called with (flag name, seconds) for each background evaluation
+        self._on_evaluated = on_evaluated or (lambda name, seconds: None)
+
+        self._values = dict(defaults)
+        self._refreshed_at = None
+        self._wake = threading.Event()
+
+    def get(self, name):
+        return self._values.get(name, self.defaults.get(name, False))
+
+    def age(self):
+        """Seconds since every flag was last evaluated successfully (None before that)."""
+        if self._refreshed_at is None:
+            return None
+        return time.monotonic() - self._refreshed_at
+
+    def refresh(self):
+        client = api.get_client()
+        values = dict(self._values)
+        complete = True
+        for name, default in self.defaults.items():
+            start = time.perf_counter()
+            details = client.get_boolean_details(name, default)
+            self._on_evaluated(name, time.perf_counter() - start)
+            if details.error_code is not None:
+                logger.warning(f"Feature flag {name} could not be evaluated: {details.error_message}")
+                complete = False
+                continue
+            values[name] = details.value
+
+        # Swapped in one assignment, so readers never see a partial update
+        self._values = values
+        if complete:
+            self._refreshed_at = time.monotonic()
+
+    def start(self):
+        api.add_handler(ProviderEvent.PROVIDER_CONFIGURATION_CHANGED, lambda details: self._wake.set())
+        api.add_handler(ProviderEvent.PROVIDER_READY, lambda details: self._wake.set())
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.refresh_interval)
+            self._wake.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Feature flag refresh failed: {e}")
@@ -3,6 +3,9 @@
 # Copyright The OpenTelemetry Authors
 # SPDX-License-Identifier: Apache-2.0
 
+from opentelemetry.metrics import Observation
+
+
 def init_metrics(meter):
 
     # Recommendations counter
@@ -10,8 +13,38 @@ def init_metrics(meter):
         'app_recommendations_counter', unit='recommendations', description="Counts the total number of given recommendations"
     )
 
+    # Catalog cache lookups by result (hit, stale, miss)
+    app_recommendation_catalog_cache_lookups = meter.create_counter(
+        'app_recommendation_catalog_cache_lookups', unit='lookups', description="Counts product catalog cache lookups by result"
+    )
+
+    # Callers that waited for an in-flight catalog fetch instead of sending their own
+    app_recommendation_catalog_coalesced_waiters = meter.create_counter(
+        'app_recommendation_catalog_coalesced_waiters', unit='requests', description="Counts catalog fetches coalesced into one already in flight"
+    )
+
+    # Background feature flag evaluations against flagd
+    app_recommendation_flag_evaluation_duration = meter.create_histogram(
+        'app_recommendation_flag_evaluation_duration', unit='s', description="Duration of feature flag evaluations that refresh the local snapshot"
+    )
+
     rec_svc_metrics = {
         "app_recommendations_counter": app_recommendations_counter,
+        "app_recommendation_catalog_cache_lookups": app_recommendation_catalog_cache_lookups,
+        "app_recommendation_catalog_coalesced_waiters": app_recommendation_catalog_coalesced_waiters,
+        "app_recommendation_flag_evaluation_duration": app_recommendation_flag_evaluation_duration,
     }
 
     return rec_svc_metrics
+
+
+def init_flag_snapshot_metrics(meter, flag_snapshot):
+
+    def observe_age(options):
+        age = flag_snapshot.age()
+        return [] if age is None else [Observation(age)]
+
+    # Seconds since the feature flag snapshot was last refreshed successfully
+    return meter.create_observable_gauge(
+        'app_recommendation_flag_snapshot_age', callbacks=[observe_age], unit='s', description="Age of the local feature flag snapshot"
+    )
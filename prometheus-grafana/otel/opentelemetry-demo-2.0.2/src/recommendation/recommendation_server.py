@@ -33,11 +33,11 @@ from grpc_health.v1 import health_pb2
 from grpc_health.v1 import health_pb2_grpc
 
 from metrics import (
-    init_metrics
+    init_metrics,
+    init_flag_snapshot_metrics
 )
-
-cached_ids = []
-first_run = True
+from catalog_cache import CatalogCache
+from flag_snapshot import FlagSnapshot
 
 class RecommendationService(demo_pb2_grpc.RecommendationServiceServicer):
     def ListRecommendations(self, request, context):
@@ -64,9 +64,23 @@ class RecommendationService(demo_pb2_grpc.RecommendationServiceServicer):
             status=health_pb2.HealthCheckResponse.UNIMPLEMENTED)
 
 
+def fetch_catalog_ids():
+    cat_response = product_catalog_stub.ListProducts(demo_pb2.Empty())
+    return [x.id for x in cat_response.products]
+
+
+def record_cache_lookup(result):
+    trace.get_current_span().set_attribute("app.cache_hit", result != "miss")
+    rec_svc_metrics["app_recommendation_catalog_cache_lookups"].add(1, {'cache.result': result})
+    if result == "miss":
+        logger.info("get_product_list: cache miss")
+
+
+def record_coalesced_fetch(key):
+    rec_svc_metrics["app_recommendation_catalog_coalesced_waiters"].add(1, {'rpc.method': key})
+
+
 def get_product_list(request_product_ids):
-    global first_run
-    global cached_ids
     with tracer.start_as_current_span("get_product_list") as span:
         max_responses = 5
 
@@ -74,26 +88,11 @@ def get_product_list(request_product_ids):
         request_product_ids_str = ''.join(request_product_ids)
         request_product_ids = request_product_ids_str.split(',')
 
-        # Feature flag scenario - Cache Leak
-        if check_feature_flag("recommendationCacheFailure"):
-            span.set_attribute("app.recommendation.cache_enabled", True)
-            if random.random() < 0.5 or first_run:
-                first_run = False
-                span.set_attribute("app.cache_hit", False)
-                logger.info("get_product_list: cache miss")
-                cat_response = product_catalog_stub.ListProducts(demo_pb2.Empty())
-                response_ids = [x.id for x in cat_response.products]
-                cached_ids = cached_ids + response_ids
-                cached_ids = cached_ids + cached_ids[:len(cached_ids) // 4]
-                product_ids = cached_ids
-            else:
-                span.set_attribute("app.cache_hit", True)
-                logger.info("get_product_list: cache hit")
-                product_ids = cached_ids
-        else:
-            span.set_attribute("app.recommendation.cache_enabled", False)
-            cat_response = product_catalog_stub.ListProducts(demo_pb2.Empty())
-            product_ids = [x.id for x in cat_response.products]
+        # Feature flag scenario - Cache Leak. The catalog cache is bounded
+        # and used either way; the flag is only reported on the span.
+        span.set_attribute("app.recommendation.cache_enabled",
+                           check_feature_flag("recommendationCacheFailure"))
+        product_ids = catalog_cache.get()
 
         span.set_attribute("app.products.count", len(product_ids))
 
@@ -121,9 +120,12 @@ def must_map_env(key: str):
 
 
 def check_feature_flag(flag_name: str):
-    # Initialize OpenFeature
-    client = api.get_client()
-    return client.get_boolean_value("recommendationCacheFailure", False)
+    # Served from the in-process snapshot; flagd is only queried in the background
+    return flag_snapshot.get(flag_name)
+
+
+def record_flag_evaluation(flag_name, seconds):
+    rec_svc_metrics["app_recommendation_flag_evaluation_duration"].record(seconds, {'feature_flag.key': flag_name})
 
 
 if __name__ == "__main__":
@@ -136,6 +138,16 @@ if __name__ == "__main__":
     meter = metrics.get_meter_provider().get_meter(service_name)
     rec_svc_metrics = init_metrics(meter)
 
+    # Feature flags read on the request path, with their defaults
+    flag_snapshot = FlagSnapshot(
+        {"recommendationCacheFailure": False},
+        refresh_interval=float(os.environ.get('FLAG_SNAPSHOT_REFRESH_INTERVAL', 30)),
+        on_evaluated=record_flag_evaluation,
+    )
+    flag_snapshot.refresh()
+    flag_snapshot.start()
+    init_flag_snapshot_metrics(meter, flag_snapshot)
+
     # Initialize Logs
     logger_provider = LoggerProvider(
         resource=Resource.create(
@@ -157,6 +169,18 @@ if __name__ == "__main__":
     pc_channel = grpc.insecure_channel(catalog_addr)
     product_catalog_stub = demo_pb2_grpc.ProductCatalogServiceStub(pc_channel)
 
+    # Recommendations are served from here; the catalog is only on the
+    # request path when the cache is empty or past its stale window
+    catalog_cache = CatalogCache(
+        fetch_catalog_ids,
+        ttl=float(os.environ.get('CATALOG_CACHE_TTL', 30)),
+        stale_ttl=float(os.environ.get('CATALOG_CACHE_STALE_TTL', 300)),
+        max_ids=int(os.environ.get('CATALOG_CACHE_MAX_IDS', 10000)),
+        on_lookup=record_cache_lookup,
+        on_coalesced=record_coalesced_fetch,
+    )
+    catalog_cache.warm_up()
+
     # Create gRPC server
     server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
 
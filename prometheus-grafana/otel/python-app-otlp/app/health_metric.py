@@ -1,12 +1,47 @@
 # health_monitor.py
-import requests
+import asyncio
+import json
+import os
+import random
 import time
+from collections import deque
+
+import aiohttp
 from opentelemetry import metrics
 from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.view import ExplicitBucketHistogramAggregation, View
 from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
 from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
 from opentelemetry.sdk.resources import Resource
-from opentelemetry.sdk.metrics._internal.measurement import Measurement
+
+# ========== CONFIG ==========
+# YAML/JSON list of targets: [{name, url, interval?, timeout?}, ...]
+HEALTH_TARGETS_FILE = os.getenv("HEALTH_TARGETS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "health_targets.yaml"))
+DEFAULT_TARGETS = [{"name": "flask-app", "url": "http://flask-app:5001/health"}]
+# Starting interval; it then adapts between PROBE_MIN_INTERVAL and
+# PROBE_MAX_INTERVAL (all overridable per target)
+PROBE_INTERVAL = float(os.getenv("PROBE_INTERVAL", "5"))
+PROBE_MIN_INTERVAL = float(os.getenv("PROBE_MIN_INTERVAL", "1"))
+PROBE_MAX_INTERVAL = float(os.getenv("PROBE_MAX_INTERVAL", "60"))
+# Interval growth per healthy probe (1 keeps intervals fixed)
+PROBE_BACKOFF = float(os.getenv("PROBE_BACKOFF", "1.5"))
+# A probe slower than SPIKE_FACTOR x the target's usual latency (and at least
+# SPIKE_MIN_DELTA seconds slower) counts as a latency spike
+PROBE_SPIKE_FACTOR = float(os.getenv("PROBE_SPIKE_FACTOR", "3"))
+PROBE_SPIKE_MIN_DELTA = float(os.getenv("PROBE_SPIKE_MIN_DELTA", "0.05"))
+# Global budget across all targets, probes per second (0 = unlimited)
+PROBE_RATE_LIMIT = float(os.getenv("PROBE_RATE_LIMIT", "50"))
+PROBE_RATE_BURST = int(os.getenv("PROBE_RATE_BURST", "10"))
+# Window over which health_probe_rate is measured
+PROBE_RATE_WINDOW = float(os.getenv("PROBE_RATE_WINDOW", "30"))
+PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", "1"))
+# Each sleep is the interval +/- this fraction, so targets don't probe in lockstep
+PROBE_JITTER = float(os.getenv("PROBE_JITTER", "0.1"))
+# Keep-alive connections shared by all targets (per host limit is separate)
+PROBE_MAX_CONNECTIONS = int(os.getenv("PROBE_MAX_CONNECTIONS", "200"))
+PROBE_MAX_CONNECTIONS_PER_HOST = int(os.getenv("PROBE_MAX_CONNECTIONS_PER_HOST", "4"))
+# Bucket boundaries (seconds) for the per-phase probe histograms
+PHASE_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5]
 
 # Configure OpenTelemetry
 resource = Resource.create({
@@ -17,7 +52,11 @@ resource = Resource.create({
 # Set up metrics export to OpenTelemetry Collector
 exporter = OTLPMetricExporter(endpoint="otel-collector:4317", insecure=True, timeout=30)
 reader = PeriodicExportingMetricReader(exporter, export_interval_millis=5000)
-provider = MeterProvider(resource=resource, metric_readers=[reader])
+phase_view = View(
+    instrument_name="health_probe_*_duration",
+    aggregation=ExplicitBucketHistogramAggregation(PHASE_BUCKETS),
+)
+provider = MeterProvider(resource=resource, metric_readers=[reader], views=[phase_view])
 metrics.set_meter_provider(provider)
 
 meter = metrics.get_meter("health.monitor")
@@ -28,85 +67,266 @@ meter = metrics.get_meter("health.monitor")
 #    description="Health status of the Flask app (1=up, 0=down)"
 #)
 
-health_gauge = meter.create_gauge(
+# Latest probe results. Probes only overwrite these tables; the observable
+# gauges below read them once per export cycle.
+health_state = {}      # target -> 1 (up) / 0 (down)
+component_state = {}   # target -> {component: 1 (ok) / 0 (error)}
+interval_state = {}    # target -> current adaptive interval (s)
+
+
+def get_health_status(callback_options=None):
+    """Returns 1 (up) or 0 (down) per target for the gauge metric."""
+    return [metrics.Observation(value, {"target": target}) for target, value in list(health_state.items())]
+
+
+def get_component_status(callback_options=None):
+    return [
+        metrics.Observation(value, {"target": target, "component": component})
+        for target, components in list(component_state.items())
+        for component, value in components.items()
+    ]
+
+
+def get_probe_intervals(callback_options=None):
+    return [metrics.Observation(value, {"target": target}) for target, value in list(interval_state.items())]
+
+
+# Create a GAUGE metric (not a counter!)
+meter.create_observable_gauge(
     name="health_status",
+    callbacks=[get_health_status],  # Called on each export
     description="1 if service is up, 0 if down",
-    unit="1"
+    unit="1",
+)
+meter.create_observable_gauge(
+    name="health_components_status",
+    callbacks=[get_component_status],
+    description="Status of individual components (1=ok, 0=error)",
+    unit="1",
+)
+meter.create_observable_gauge(
+    name="health_probe_interval",
+    callbacks=[get_probe_intervals],
+    description="Current adaptive probe interval per target",
+    unit="s",
 )
-
-last_status = None
 
 response_time = meter.create_histogram(
     "health_response_time",
     description="Response time of health endpoint in seconds",
     unit="s"
 )
-health_components = meter.create_up_down_counter(
-    "health_components_status",
-    description="Status of individual components (1=ok, 0=error)"
+# Where a probe's time went: pool wait and DNS/connect are on our side or the
+# network, TTFB is mostly the target app, body is transfer of the response.
+# DNS and connect are only recorded when they happen (not for reused
+# connections or cached lookups); connect includes the TLS handshake.
+PHASES = ("pool_wait", "dns", "connect", "ttfb", "body")
+phase_histograms = {
+    phase: meter.create_histogram(
+        f"health_probe_{phase}_duration",
+        description=f"Health probe {phase} time in seconds",
+        unit="s"
+    )
+    for phase in PHASES
+}
+probes_total = meter.create_counter(
+    "health_probes_total",
+    description="Health probes sent, by outcome"
 )
 
-def get_health_status(callback_options=None):
-    """Returns 1 (up) or 0 (down) for the gauge metric."""
-    global last_status
-    return [Measurement(1 if last_status else 0)]
+def load_targets(path: str = HEALTH_TARGETS_FILE) -> list[dict]:
+    """Targets from the YAML/JSON file, or the single flask-app target."""
+    if not os.path.exists(path):
+        return DEFAULT_TARGETS
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+            targets = yaml.safe_load(f) or []
+        else:
+            targets = json.load(f)
+    for target in targets:
+        target.setdefault("name", target["url"])
+    return targets
+
+
+# --- Probe phase tracing ---
+# Each hook stores a monotonic timestamp in the per-request dict passed as
+# trace_request_ctx; check_health turns them into phase durations.
+def _mark(name):
+    async def hook(session, ctx, params):
+        ctx.trace_request_ctx[name] = time.perf_counter()
+    return hook
+
 
+PHASE_TRACE = aiohttp.TraceConfig()
+PHASE_TRACE.on_connection_queued_start.append(_mark("queued_start"))
+PHASE_TRACE.on_connection_queued_end.append(_mark("queued_end"))
+PHASE_TRACE.on_dns_resolvehost_start.append(_mark("dns_start"))
+PHASE_TRACE.on_dns_resolvehost_end.append(_mark("dns_end"))
+PHASE_TRACE.on_connection_create_start.append(_mark("connect_start"))
+PHASE_TRACE.on_connection_create_end.append(_mark("connect_end"))
+PHASE_TRACE.on_request_headers_sent.append(_mark("headers_sent"))
+PHASE_TRACE.on_request_end.append(_mark("headers_received"))
+
+
+def phase_durations(marks: dict, body_done: float) -> dict:
+    """Phase -> seconds for the phases this request went through."""
+    durations = {}
+    if "queued_end" in marks:
+        durations["pool_wait"] = marks["queued_end"] - marks["queued_start"]
+    dns = 0.0
+    if "dns_end" in marks:
+        dns = durations["dns"] = marks["dns_end"] - marks["dns_start"]
+    if "connect_end" in marks:
+        # aiohttp resolves the host inside connection creation
+        durations["connect"] = marks["connect_end"] - marks["connect_start"] - dns
+    if "headers_received" in marks:
+        durations["ttfb"] = marks["headers_received"] - marks.get("headers_sent", marks["headers_received"])
+        durations["body"] = body_done - marks["headers_received"]
+    return durations
+
+
+def record_components(target_name: str, data: dict):
+    # Replaced as a whole so components that disappear are no longer reported
+    component_state[target_name] = {
+        component: 1 if status == "ok" else 0
+        for component, status in data["details"].items()
+    }
+
+
+async def check_health(session: aiohttp.ClientSession, target: dict):
+    """Probe one target and record its metrics; returns (ok, duration or None)"""
+    attributes = {"target": target["name"]}
+    timeout = aiohttp.ClientTimeout(total=target.get("timeout", PROBE_TIMEOUT))
+    marks = {}
+    start_time = time.perf_counter()
 
-def check_health():
-    """Check the health endpoint and record metrics"""
-    global last_status
-    start_time = time.time()
-    
     try:
-        response = requests.get("http://flask-app:5001/health", timeout=1)
-        last_status = response.ok
-
-        duration = time.time() - start_time
-        
-        # Record response time
-        response_time.record(duration)
-
-        health_gauge.set(1 if response.ok else 0)
-
-        if response.status_code == 200:
-            # Health is up
-            #health_status.add(1, {"app": "flask-sample"})
-            
-            # Record component statuses
-            data = response.json()
-            for component, status in data["details"].items():
-                value = 1 if status == "ok" else 0
-                health_components.add(value, {"component": component})
-        else:
-            # Health is down
-            #health_status.add(0, {"app": "flask-sample"})
-            
-            # Record component statuses if available
-            try:
-                data = response.json()
-                for component, status in data["details"].items():
-                    value = 1 if status == "ok" else 0
-                    health_components.add(value, {"component": component})
-            except:
-                pass
-    
+        async with session.get(target["url"], timeout=timeout, trace_request_ctx=marks) as response:
+            body = await response.read()
+
+        body_done = time.perf_counter()
+        duration = body_done - start_time
+
+        # Record response time, total and per phase
+        response_time.record(duration, attributes)
+        for phase, seconds in phase_durations(marks, body_done).items():
+            phase_histograms[phase].record(seconds, attributes)
+
+        health_state[target["name"]] = 1 if response.ok else 0
+
+        # Record component statuses if available
+        try:
+            record_components(target["name"], json.loads(body))
+        except Exception:
+            if response.status == 200:
+                raise
+        return response.ok, duration
+
     except Exception as e:
-        # Record failure
-        #last_status = False
-        health_gauge.set(0)
-        #health_status.add(0, {"app": "flask-sample"})
-        print(f"Health check failed: {str(e)}")
+        # Record failure; component states are unknown while it is unreachable
+        health_state[target["name"]] = 0
+        component_state.pop(target["name"], None)
+        print(f"Health check failed for {target['name']}: {e!r}")
+        return False, None
 
-# Create a GAUGE metric (not a counter!)
-#health_status = meter.create_observable_gauge(
-#    name="health_status",
-#    callbacks=[get_health_status],  # Called on each export
-#    description="1 if service is up, 0 if down",
-#    unit="1",
-#)
 
-if __name__ == "__main__":
-    print("Starting health monitor...")
+# --- Adaptive scheduling ---
+class AdaptiveInterval:
+    """
+    Per-target probe interval: grows by PROBE_BACKOFF after each healthy
+    probe up to the maximum, and drops to the minimum right after a failure
+    or a latency spike.
+    """
+
+    def __init__(self, target: dict):
+        self.min = target.get("min_interval", PROBE_MIN_INTERVAL)
+        self.max = target.get("max_interval", PROBE_MAX_INTERVAL)
+        self.interval = target.get("interval", PROBE_INTERVAL)
+        self.latency = None  # EWMA of healthy probe durations
+
+    def update(self, ok: bool, duration) -> float:
+        spike = (
+            ok and self.latency is not None
+            and duration > self.latency * PROBE_SPIKE_FACTOR
+            and duration - self.latency > PROBE_SPIKE_MIN_DELTA
+        )
+        if ok:
+            self.latency = duration if self.latency is None else 0.8 * self.latency + 0.2 * duration
+
+        if ok and not spike:
+            self.interval = min(self.interval * PROBE_BACKOFF, self.max)
+        else:
+            self.interval = self.min
+        return self.interval
+
+
+class ProbeBudget:
+    """
+    Global probes-per-second limit. Each acquire() reserves the next free
+    slot (GCRA), so waiting probes run in order without polling, and up to
+    `burst` probes may go at once after an idle period.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.spacing = 1 / rate if rate > 0 else 0
+        self.burst = burst
+        self._next_slot = time.monotonic()
+        self._sent = deque()  # probe timestamps within PROBE_RATE_WINDOW
+
+    async def acquire(self):
+        now = time.monotonic()
+        if self.spacing:
+            slot = max(self._next_slot, now - self.burst * self.spacing)
+            self._next_slot = slot + self.spacing
+            if slot > now:
+                await asyncio.sleep(slot - now)
+                now = slot
+        self._sent.append(now)
+
+    def rate(self) -> float:
+        """Probes per second actually sent over the last PROBE_RATE_WINDOW."""
+        cutoff = time.monotonic() - PROBE_RATE_WINDOW
+        while self._sent and self._sent[0] < cutoff:
+            self._sent.popleft()
+        return len(self._sent) / PROBE_RATE_WINDOW
+
+
+budget = ProbeBudget(PROBE_RATE_LIMIT, PROBE_RATE_BURST)
+
+meter.create_observable_gauge(
+    name="health_probe_rate",
+    callbacks=[lambda options: [metrics.Observation(budget.rate())]],
+    description="Effective health probes per second across all targets",
+    unit="1/s"
+)
+
+
+async def run_target(session: aiohttp.ClientSession, target: dict):
+    """Probe a target forever at its adaptive interval, with jitter."""
+    schedule = AdaptiveInterval(target)
+    # Spread the first probes over one interval instead of a thundering herd
+    await asyncio.sleep(random.uniform(0, schedule.interval))
     while True:
-        check_health()
-        time.sleep(5)  # Check every 5 seconds
+        await budget.acquire()
+        ok, duration = await check_health(session, target)
+        probes_total.add(1, {"result": "ok" if ok else "fail"})
+        interval = interval_state[target["name"]] = schedule.update(ok, duration)
+        await asyncio.sleep(interval * random.uniform(1 - PROBE_JITTER, 1 + PROBE_JITTER))
+
+
+async def monitor(targets: list[dict]):
+    # One pooled session: connections stay open between probes of a target
+    connector = aiohttp.TCPConnector(
+        limit=PROBE_MAX_CONNECTIONS,
+        limit_per_host=PROBE_MAX_CONNECTIONS_PER_HOST,
+        ttl_dns_cache=300,
+    )
+    async with aiohttp.ClientSession(connector=connector, trace_configs=[PHASE_TRACE]) as session:
+        await asyncio.gather(*(run_target(session, target) for target in targets))
+
+
+if __name__ == "__main__":
+    targets = load_targets()
+    print(f"Starting health monitor for {len(targets)} targets...")
+    asyncio.run(monitor(targets))
@@ -29,6 +29,26 @@ PROJECT_ID = os.getenv("GCP_PROJECT_ID", "my-kube-project-429018")
 PUBSUB_TOPIC = os.getenv("PUBSUB_TOPIC", "otel-metrics")
 store_id = "5555"
 
+# Pub/Sub message attributes let consumers route (and subscriptions filter)
+# without decoding the payload
+RECORD_TYPE_METRIC = "metric"
+RECORD_TYPE_LOG = "log"
+SCHEMA_VERSION = "1"
+ENCODING = "json"
+
+# "string" keeps attributes/resource as JSON-encoded strings (schema 1);
+# "native" sends them as nested objects (schema 2) for BigQuery JSON/STRUCT columns
+ATTRIBUTE_ENCODING = os.getenv("ATTRIBUTE_ENCODING", "string")
+METRIC_SCHEMA_VERSION = "2" if ATTRIBUTE_ENCODING == "native" else SCHEMA_VERSION
+
+# Metric rows are packed into JSON array messages. Pub/Sub caps a message at
+# 10 MB and a publish request at 1000 messages / 10 MB, so stay below both.
+MAX_ROWS_PER_MESSAGE = int(os.getenv("MAX_ROWS_PER_MESSAGE", "1000"))
+MAX_MESSAGE_BYTES = int(os.getenv("MAX_MESSAGE_BYTES", str(9 * 1024 * 1024)))
+PUBLISH_BATCH_MAX_MESSAGES = int(os.getenv("PUBLISH_BATCH_MAX_MESSAGES", "1000"))
+PUBLISH_BATCH_MAX_BYTES = int(os.getenv("PUBLISH_BATCH_MAX_BYTES", str(9 * 1024 * 1024)))
+PUBLISH_BATCH_MAX_LATENCY = float(os.getenv("PUBLISH_BATCH_MAX_LATENCY", "0.05"))
+
 # =========================
 # LOGGING SETUP
 # =========================
@@ -43,7 +63,13 @@ logging.basicConfig(
 app = FastAPI()
 
 # --- Pub/Sub Publisher ---
-publisher = pubsub_v1.PublisherClient()
+publisher = pubsub_v1.PublisherClient(
+    batch_settings=pubsub_v1.types.BatchSettings(
+        max_messages=PUBLISH_BATCH_MAX_MESSAGES,
+        max_bytes=PUBLISH_BATCH_MAX_BYTES,
+        max_latency=PUBLISH_BATCH_MAX_LATENCY,
+    )
+)
 topic_path = publisher.topic_path(PROJECT_ID, PUBSUB_TOPIC)
 
 
@@ -79,6 +105,7 @@ def transform_metric(raw_body: bytes) -> list[dict]:
         return None
 
     transformed = []
+    native = ATTRIBUTE_ENCODING == "native"
 
     # OTLP metrics are nested under resourceMetrics
     for rm in msg.get("resourceMetrics", []):
@@ -106,8 +133,8 @@ def transform_metric(raw_body: bytes) -> list[dict]:
                             "metric_name": metric_name,
                             "timestamp": dp.get("timeUnixNano"),
                             "value": dp.get("asDouble") or dp.get("asInt"),
-                            "attributes": json.dumps(dp_attrs),
-                            "resource": json.dumps(resource_attrs_dict),
+                            "attributes": dp_attrs if native else json.dumps(dp_attrs),
+                            "resource": resource_attrs_dict if native else json.dumps(resource_attrs_dict),
                         }
                         transformed.append(row)
 
@@ -117,30 +144,75 @@ def transform_metric(raw_body: bytes) -> list[dict]:
 
 
 # --- Downstream Sender (now Pub/Sub) ---
+def message_attributes(record_type: str, row_count: int, schema_version: str = SCHEMA_VERSION) -> dict:
+    return {
+        "record_type": record_type,
+        "schema_version": schema_version,
+        "encoding": ENCODING,
+        "row_count": str(row_count),
+    }
+
+
+def pack_rows(rows: list[dict], record_type: str, schema_version: str = SCHEMA_VERSION) -> list[tuple[bytes, dict]]:
+    """
+    Pack rows into JSON array messages of at most MAX_ROWS_PER_MESSAGE rows
+    and MAX_MESSAGE_BYTES bytes. Returns (data, attributes) pairs.
+    """
+    messages = []
+    chunk, chunk_bytes = [], 2  # the surrounding "[" and "]"
+
+    def close_chunk():
+        data = b"[" + b",".join(chunk) + b"]"
+        messages.append((data, message_attributes(record_type, len(chunk), schema_version)))
+
+    for row in rows:
+        encoded = json.dumps(row).encode("utf-8")
+        if chunk and (len(chunk) >= MAX_ROWS_PER_MESSAGE
+                      or chunk_bytes + len(encoded) + 1 > MAX_MESSAGE_BYTES):
+            close_chunk()
+            chunk, chunk_bytes = [], 2
+        chunk.append(encoded)
+        chunk_bytes += len(encoded) + 1
+
+    if chunk:
+        close_chunk()
+    return messages
+
+
 def send_downstream(body, is_metric=False):
     if is_metric:
         payloads = transform_metric(body)
         if not payloads:
             return False
-        messages = [json.dumps(p).encode("utf-8") for p in payloads]
+        messages = pack_rows(payloads, RECORD_TYPE_METRIC, METRIC_SCHEMA_VERSION)
     else:
         try:
             payload = json.loads(body.decode("utf-8"))
-            messages = [json.dumps(payload).encode("utf-8")]
+            row_count = len(payload) if isinstance(payload, list) else 1
+            messages = [(json.dumps(payload).encode("utf-8"), message_attributes(RECORD_TYPE_LOG, row_count))]
         except Exception as e:
             logging.error(f"⚠️ Could not decode message body: {e}")
             return False
 
+    # Publish everything at once so the client can batch, then only resend
+    # the messages that failed
+    pending = messages
     while True:
-        try:
-            for msg in messages:
-                future = publisher.publish(topic_path, msg)
-                logging.info(f"✅ Published to Pub/Sub {PUBSUB_TOPIC}: {msg[:200]}...")
+        futures = [(msg, publisher.publish(topic_path, msg[0], **msg[1])) for msg in pending]
+        failed = []
+        for msg, future in futures:
+            try:
                 future.result()  # wait for publish
+                logging.info(f"✅ Published {msg[1]['row_count']} rows to Pub/Sub {PUBSUB_TOPIC}: {msg[0][:200]}...")
+            except Exception as e:
+                logging.error(f"🌐 Pub/Sub error: {e}")
+                failed.append(msg)
+
+        if not failed:
             return True
-        except Exception as e:
-            logging.error(f"🌐 Pub/Sub error: {e}, retrying in 5s...")
-            time.sleep(5)
+        logging.error(f"🌐 {len(failed)} Pub/Sub messages failed, retrying in 5s...")
+        pending = failed
+        time.sleep(5)
 
 
 # --- Consumer Callback ---
@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+# ========== RULE FILE ==========
+# metrics:
+#   <metric name>:
+#     help: <description>
+#     labels: [<label>, ...]
+#     limited_labels: [<label>, ...]   # optional, folded into overflow series
+#     max_series: <int>                # optional
+# rules:
+#   - name: <rule name>
+#     match:                           # all conditions must hold
+#       <field>: <value>               # shorthand for {equals: <value>}
+#       <field>: {equals|prefix|regex: <str>} or {in: [<str>, ...]}
+#     extract:                         # optional, named groups become values
+#       <field>: <regex with (?P<name>...) groups>
+#     metric: <metric name>
+#     labels:
+#       <label>: "{<field or group>}" or a literal
+
+
+def load_rules_file(path: str) -> dict:
+    """Read a rule file (YAML or JSON, chosen by extension)."""
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+            return yaml.safe_load(f) or {}
+        return json.load(f)
+
+
+def _condition_regex(op: str, value) -> str:
+    """Regex, applied with re.match, that holds when the condition does."""
+    if op == "equals":
+        return re.escape(str(value)) + r"\Z"
+    if op == "in":
+        return "(?:" + "|".join(re.escape(str(v)) for v in value) + r")\Z"
+    if op == "prefix":
+        return re.escape(str(value))
+    if op == "regex":
+        return ".*?(?:" + value + ")"
+    raise ValueError(f"Unknown match operator: {op}")
+
+
+def _compile_label(template):
+    """'{name}' reads a field or extracted group, anything else is a literal."""
+    if isinstance(template, str) and template.startswith("{") and template.endswith("}"):
+        return (True, template[1:-1])
+    return (False, str(template))
+
+
+class _Rule:
+    __slots__ = ("name", "index", "conditions", "extract", "metric", "labels")
+
+
+class RuleEngine:
+    """
+    Compiled log-to-metric rules. All conditions on the same field, across
+    every rule, are folded into one regex of optional lookaheads, so each
+    field of an event is scanned once no matter how many rules exist.
+    """
+
+    def __init__(self, config: dict):
+        self.metrics = config.get("metrics", {})
+        self.rules = []
+        conditions_by_field = {}  # field -> [(group name, regex)]
+
+        for index, spec in enumerate(config.get("rules", [])):
+            rule = _Rule()
+            rule.name = spec["name"]
+            rule.index = index
+            rule.metric = spec["metric"]
+            if rule.metric not in self.metrics:
+                raise ValueError(f"Rule {rule.name} targets undefined metric {rule.metric}")
+
+            rule.conditions = set()
+            for field, cond in (spec.get("match") or {}).items():
+                if not isinstance(cond, dict):
+                    cond = {"equals": cond}
+                for op, value in cond.items():
+                    group = f"c{index}_{len(rule.conditions)}"
+                    conditions_by_field.setdefault(field, []).append((group, _condition_regex(op, value)))
+                    rule.conditions.add(group)
+
+            rule.extract = [
+                (field, re.compile(pattern)) for field, pattern in (spec.get("extract") or {}).items()
+            ]
+
+            label_specs = spec.get("labels") or {}
+            labelnames = self.metrics[rule.metric]["labels"]
+            missing = set(labelnames) - set(label_specs)
+            if missing:
+                raise ValueError(f"Rule {rule.name} does not set labels {sorted(missing)}")
+            rule.labels = [_compile_label(label_specs[name]) for name in labelnames]
+
+            self.rules.append(rule)
+
+        self._matchers = [
+            (field, re.compile("".join(f"(?=(?P<{group}>{regex}))?" for group, regex in conds), re.S))
+            for field, conds in conditions_by_field.items()
+        ]
+
+    def evaluate(self, event):
+        """
+        Return [(rule, label_values)] for every rule the event satisfies.
+        event is any object exposing the matched fields as attributes.
+        """
+        satisfied = set()
+        for field, matcher in self._matchers:
+            value = getattr(event, field, None)
+            if value is None:
+                continue
+            for group, hit in matcher.match(str(value)).groupdict().items():
+                if hit is not None:
+                    satisfied.add(group)
+
+        results = []
+        for rule in self.rules:
+            if not rule.conditions <= satisfied:
+                continue
+
+            extracted = {}
+            for field, pattern in rule.extract:
+                value = getattr(event, field, None)
+                match = pattern.search(value) if value is not None else None
+                if match:
+                    extracted.update(match.groupdict())
+                else:
+                    extracted.update(dict.fromkeys(pattern.groupindex))
+
+            label_values = tuple(
+                (extracted[key] if key in extracted else getattr(event, key, None)) if is_ref else key
+                for is_ref, key in rule.labels
+            )
+            results.append((rule, label_values))
+        return results
+
+
+class RuleReloader:
+    """Poll the rule file and hand a freshly compiled RuleEngine to on_reload."""
+
+    def __init__(self, path: str, on_reload, interval: float = 5.0):
+        self.path = path
+        self.on_reload = on_reload
+        self.interval = interval
+        self._mtime = None
+
+    def load(self):
+        """Compile the file now; raises if it is invalid."""
+        # Remember the mtime first so a broken file is reported only once
+        self._mtime = os.path.getmtime(self.path)
+        engine = RuleEngine(load_rules_file(self.path))
+        self.on_reload(engine)
+        return engine
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                if os.path.getmtime(self.path) != self._mtime:
+                    self.load()
+                    logging.info(f"Reloaded log metric rules from {self.path}")
+            except Exception as e:
+                # Keep serving with the previous rules
+                logging.error(f"Could not reload rules from {self.path}: {e}")
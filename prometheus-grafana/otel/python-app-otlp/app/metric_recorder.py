@@ -0,0 +1,369 @@
+import logging
+import math
+import threading
+from bisect import bisect_left
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+from prometheus_client.registry import REGISTRY
+
+
+# ========== BOUND CHILDREN ==========
+class BoundChildren:
+    """
+    Cache of metric.labels(...) children keyed by the label value tuple, so
+    the hot path skips prometheus_client's label validation and child lookup.
+    """
+
+    def __init__(self, metric):
+        self._metric = metric
+        self._children = {}
+
+    def get(self, label_values: tuple):
+        child = self._children.get(label_values)
+        if child is None:
+            child = self._children.setdefault(label_values, self._metric.labels(*label_values))
+        return child
+
+    def inc(self, label_values: tuple, amount: float = 1):
+        self.get(label_values).inc(amount)
+
+    def observe(self, label_values: tuple, value: float):
+        self.get(label_values).observe(value)
+
+
+# ========== SHARDED COUNTER ==========
+class ShardedCounter:
+    """
+    Counter whose increments land in a per-thread shard (a plain dict owned
+    by that thread), so recording takes no lock. Shards are summed when the
+    registry is scraped.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames, registry=REGISTRY):
+        self._name = name
+        self._documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _new_shard(self):
+        shard = self._local.shard = {}
+        with self._shards_lock:
+            self._shards.append(shard)
+        return shard
+
+    def inc(self, label_values: tuple, amount: float = 1):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard[label_values] = shard.get(label_values, 0) + amount
+
+    def totals(self) -> dict:
+        """Merge all shards into {label_values: value}."""
+        with self._shards_lock:
+            shards = list(self._shards)
+
+        totals = {}
+        for shard in shards:
+            # list() copies under the GIL while the owner thread keeps writing
+            for label_values, value in list(shard.items()):
+                totals[label_values] = totals.get(label_values, 0) + value
+        return totals
+
+    def describe(self):
+        yield CounterMetricFamily(self._name, self._documentation, labels=self._labelnames)
+
+    def collect(self):
+        family = CounterMetricFamily(self._name, self._documentation, labels=self._labelnames)
+        for label_values, value in self.totals().items():
+            family.add_metric([str(v) for v in label_values], value)
+        yield family
+
+
+class ShardedHistogram:
+    """
+    Histogram with the same per-thread sharding as ShardedCounter: observe()
+    is a bisect plus two list updates on the calling thread's shard.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames, buckets, registry=REGISTRY):
+        self._name = name
+        self._documentation = documentation
+        self._labelnames = tuple(labelnames)
+        # +Inf is always the last bucket, as in prometheus_client
+        self._bounds = [float(b) for b in buckets if float(b) != math.inf]
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _new_shard(self):
+        shard = self._local.shard = {}
+        with self._shards_lock:
+            self._shards.append(shard)
+        return shard
+
+    def observe(self, label_values: tuple, value: float):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        series = shard.get(label_values)
+        if series is None:
+            # one count per bucket plus +Inf, then the sum
+            series = shard[label_values] = [[0] * (len(self._bounds) + 1), 0.0]
+        series[0][bisect_left(self._bounds, value)] += 1
+        series[1] += value
+
+    def describe(self):
+        yield HistogramMetricFamily(self._name, self._documentation, labels=self._labelnames)
+
+    def _merged(self):
+        """{label values: [per-bucket counts, sum]} over all shards."""
+        with self._shards_lock:
+            shards = list(self._shards)
+
+        merged = {}
+        for shard in shards:
+            for label_values, (counts, total) in list(shard.items()):
+                entry = merged.setdefault(label_values, [[0] * len(counts), 0.0])
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+        return merged
+
+    def collect(self):
+        family = HistogramMetricFamily(self._name, self._documentation, labels=self._labelnames)
+        bounds = [str(b) for b in self._bounds] + ["+Inf"]
+        for label_values, (counts, total) in self._merged().items():
+            cumulative, buckets = 0, []
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                buckets.append((bound, cumulative))
+            family.add_metric([str(v) for v in label_values], buckets, total)
+        yield family
+
+
+class LoopGauge:
+    """
+    Unlabelled gauge for values only touched from one thread (e.g. the
+    asyncio event loop), so inc/dec are plain integer updates.
+    """
+
+    def __init__(self, name: str, documentation: str, registry=REGISTRY):
+        self._name = name
+        self._documentation = documentation
+        self.value = 0
+        if registry is not None:
+            registry.register(self)
+
+    def inc(self):
+        self.value += 1
+
+    def dec(self):
+        self.value -= 1
+
+    def describe(self):
+        yield GaugeMetricFamily(self._name, self._documentation)
+
+    def collect(self):
+        yield GaugeMetricFamily(self._name, self._documentation, value=self.value)
+
+
+# ========== BUFFERED (MULTIPROCESS) ==========
+class BufferedHistogram(ShardedHistogram):
+    """
+    ShardedHistogram that is not exposed itself: flush() adds what was
+    observed since the previous flush to a prometheus_client Histogram with
+    the same labels and buckets. In multiprocess mode that Histogram writes
+    to the worker's mmap files, so observe() skips its locked file writes and
+    scrapes lag by up to one flush interval.
+    """
+
+    def __init__(self, target, labelnames, buckets):
+        super().__init__("", "", labelnames, buckets, registry=None)
+        self._target = BoundChildren(target)
+        self._flushed = {}  # label values -> [counts, sum] already added
+
+    def flush(self):
+        for label_values, (counts, total) in self._merged().items():
+            done_counts, done_total = self._flushed.get(label_values) or ([0] * len(counts), 0.0)
+            child = self._target.get(label_values)
+            deltas = [count - done for count, done in zip(counts, done_counts)]
+            if self._has_private_values(child, len(counts)):
+                # Histogram.observe() keeps one (non-cumulative) value per
+                # bucket plus the sum; add to them directly
+                for bucket, delta in zip(child._buckets, deltas):
+                    if delta:
+                        bucket.inc(delta)
+                if total != done_total:
+                    child._sum.inc(total - done_total)
+            else:
+                self._replay(child, deltas)
+            self._flushed[label_values] = [counts, total]
+
+    def _has_private_values(self, child, n_buckets: int) -> bool:
+        """
+        True if child has the _buckets/_sum values flush() adds to (checked
+        with prometheus-client 0.12-0.26). Otherwise switch to observing the
+        target directly from now on.
+        """
+        buckets = getattr(child, "_buckets", None)
+        if (isinstance(buckets, list) and len(buckets) == n_buckets
+                and all(hasattr(b, "inc") for b in buckets)
+                and hasattr(getattr(child, "_sum", None), "inc")):
+            return True
+        if self.observe != self._target.observe:
+            logging.warning("⚠️ prometheus_client Histogram has no _buckets/_sum, "
+                            "observing it directly instead of buffering")
+            self.observe = self._target.observe
+        return False
+
+    def _replay(self, child, deltas):
+        """Observe each bucket's count at its upper bound; the sum is approximate."""
+        values = self._bounds + [math.nextafter(self._bounds[-1], math.inf)]
+        for value, delta in zip(values, deltas):
+            for _ in range(delta):
+                child.observe(value)
+
+
+class BufferedGauge(LoopGauge):
+    """LoopGauge that is not exposed itself: flush() sets a prometheus_client Gauge to its value."""
+
+    def __init__(self, target):
+        super().__init__("", "", registry=None)
+        self._target = target
+        self._flushed = None
+
+    def flush(self):
+        value = self.value
+        if value != self._flushed:
+            self._target.set(value)
+            self._flushed = value
+
+
+class PeriodicFlusher:
+    """Daemon thread calling flush() on buffered metrics every `interval` seconds."""
+
+    def __init__(self, metrics, interval: float = 1.0):
+        self.metrics = list(metrics)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def flush(self):
+        with self._lock:
+            for metric in self.metrics:
+                try:
+                    metric.flush()
+                except Exception as e:
+                    logging.error(f"Could not flush buffered metric: {e}")
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        """Stop the thread and flush once more."""
+        self._stop.set()
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+
+# ========== CARDINALITY LIMITER ==========
+class TopK:
+    """Space-Saving heavy hitters: approximate top-k counts in bounded memory."""
+
+    def __init__(self, k: int, capacity: int = None):
+        self.k = k
+        self.capacity = capacity or k * 10
+        self.counts = {}
+
+    def add(self, value):
+        counts = self.counts
+        if value in counts:
+            counts[value] += 1
+        elif len(counts) < self.capacity:
+            counts[value] = 1
+        else:
+            # Evict the lightest entry; the newcomer inherits its count
+            victim = min(counts, key=counts.get)
+            counts[value] = counts.pop(victim) + 1
+
+    def top(self):
+        return sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)[:self.k]
+
+
+class CardinalityLimiter:
+    """
+    Series budget for one metric. Label tuples seen before (or while the
+    budget lasts) pass through unchanged; new tuples beyond max_series have
+    their limited labels replaced by overflow_value so they land in a
+    single overflow series.
+
+    overflow_counter / series_gauge are optional bound children that report
+    overflowed events and the number of admitted series.
+    """
+
+    def __init__(self, labelnames, limited_labels, max_series: int = 1000,
+                 overflow_value: str = "__overflow__", top_k: int = 10,
+                 overflow_counter=None, series_gauge=None):
+        self.labelnames = tuple(labelnames)
+        self.limited = tuple(self.labelnames.index(name) for name in limited_labels)
+        self.max_series = max_series
+        self.overflow_value = overflow_value
+        self.overflow_counter = overflow_counter
+        self.series_gauge = series_gauge
+
+        self._series = set()
+        self._top = {self.labelnames[i]: TopK(top_k) for i in self.limited}
+        self._lock = threading.Lock()
+
+    def admit(self, label_values: tuple) -> tuple:
+        """Return the label tuple to record under."""
+        return self.admit_many([label_values])[0]
+
+    def admit_many(self, batch) -> list:
+        """admit() for a batch of label tuples under a single lock acquisition."""
+        admitted, overflowed = [], 0
+        with self._lock:
+            series_before = len(self._series)
+            for label_values in batch:
+                for i in self.limited:
+                    self._top[self.labelnames[i]].add(label_values[i])
+
+                if label_values in self._series:
+                    admitted.append(label_values)
+                elif len(self._series) < self.max_series:
+                    self._series.add(label_values)
+                    admitted.append(label_values)
+                else:
+                    overflowed += 1
+                    admitted.append(self._overflow(label_values))
+            series_count = len(self._series)
+
+        if self.series_gauge is not None and series_count != series_before:
+            self.series_gauge.set(series_count)
+        if overflowed and self.overflow_counter is not None:
+            self.overflow_counter.inc(overflowed)
+        return admitted
+
+    def _overflow(self, label_values: tuple) -> tuple:
+        values = list(label_values)
+        for i in self.limited:
+            values[i] = self.overflow_value
+        return tuple(values)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "series": len(self._series),
+                "max_series": self.max_series,
+                "top_values": {name: top.top() for name, top in self._top.items()},
+            }
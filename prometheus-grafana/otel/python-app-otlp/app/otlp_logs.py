@@ -0,0 +1,148 @@
+import base64
+import gzip
+import json
+import time
+
+from opentelemetry.proto.collector.logs.v1.logs_service_pb2 import (
+    ExportLogsServiceRequest,
+    ExportLogsServiceResponse,
+)
+
+PROTOBUF_CONTENT_TYPE = "application/x-protobuf"
+JSON_CONTENT_TYPE = "application/json"
+
+
+# ========== ANY VALUE DECODING ==========
+def _proto_value(value):
+    kind = value.WhichOneof("value")
+    if kind is None:
+        return None
+    if kind == "array_value":
+        return [_proto_value(v) for v in value.array_value.values]
+    if kind == "kvlist_value":
+        return {kv.key: _proto_value(kv.value) for kv in value.kvlist_value.values}
+    if kind == "bytes_value":
+        return base64.b64encode(value.bytes_value).decode("ascii")  # as in OTLP/JSON
+    return getattr(value, kind)
+
+
+def _json_value(value: dict):
+    if not value:
+        return None
+    kind, inner = next(iter(value.items()))
+    if kind == "intValue":
+        return int(inner)  # int64 is a string in OTLP/JSON
+    if kind == "arrayValue":
+        return [_json_value(v) for v in inner.get("values", [])]
+    if kind == "kvlistValue":
+        return {kv["key"]: _json_value(kv.get("value", {})) for kv in inner.get("values", [])}
+    return inner
+
+
+# ========== REQUEST DECODING ==========
+def _records_from_proto(request: ExportLogsServiceRequest):
+    for resource_logs in request.resource_logs:
+        resource = {kv.key: _proto_value(kv.value) for kv in resource_logs.resource.attributes}
+        for scope_logs in resource_logs.scope_logs:
+            for record in scope_logs.log_records:
+                yield {
+                    "resource": resource,
+                    "scope": scope_logs.scope.name,
+                    "time_unix_nano": record.time_unix_nano or record.observed_time_unix_nano,
+                    "severity_text": record.severity_text,
+                    "severity_number": record.severity_number,
+                    "body": _proto_value(record.body),
+                    "attributes": {kv.key: _proto_value(kv.value) for kv in record.attributes},
+                }
+
+
+def _records_from_json(request: dict):
+    for resource_logs in request.get("resourceLogs", []):
+        resource = {
+            kv["key"]: _json_value(kv.get("value", {}))
+            for kv in resource_logs.get("resource", {}).get("attributes", [])
+        }
+        for scope_logs in resource_logs.get("scopeLogs", []):
+            scope = scope_logs.get("scope", {}).get("name", "")
+            for record in scope_logs.get("logRecords", []):
+                yield {
+                    "resource": resource,
+                    "scope": scope,
+                    "time_unix_nano": int(record.get("timeUnixNano") or record.get("observedTimeUnixNano") or 0),
+                    "severity_text": record.get("severityText", ""),
+                    "severity_number": record.get("severityNumber", 0),
+                    "body": _json_value(record.get("body", {})),
+                    "attributes": {
+                        kv["key"]: _json_value(kv.get("value", {}))
+                        for kv in record.get("attributes", [])
+                    },
+                }
+
+
+def decode_logs_request(body: bytes, content_type: str, content_encoding: str = "") -> list[dict]:
+    """
+    Flatten an OTLP/HTTP ExportLogsServiceRequest (protobuf or JSON, optionally
+    gzipped) into one dict per log record with resource/record attributes
+    resolved to plain Python values.
+    """
+    if "gzip" in content_encoding:
+        body = gzip.decompress(body)
+
+    if content_type.startswith(JSON_CONTENT_TYPE):
+        return list(_records_from_json(json.loads(body)))
+
+    request = ExportLogsServiceRequest()
+    request.ParseFromString(body)
+    return list(_records_from_proto(request))
+
+
+def encode_logs_response(content_type: str, rejected: int = 0, error_message: str = "") -> tuple[bytes, str]:
+    """
+    ExportLogsServiceResponse in the request's encoding: empty when every
+    record was accepted, else with partial_success set.
+    """
+    if content_type.startswith(JSON_CONTENT_TYPE):
+        if not rejected:
+            return b"{}", JSON_CONTENT_TYPE
+        body = {"partialSuccess": {"rejectedLogRecords": str(rejected), "errorMessage": error_message}}
+        return json.dumps(body).encode(), JSON_CONTENT_TYPE
+
+    response = ExportLogsServiceResponse()
+    if rejected:
+        response.partial_success.rejected_log_records = rejected
+        response.partial_success.error_message = error_message
+    return response.SerializeToString(), PROTOBUF_CONTENT_TYPE
+
+
+# ========== RECORD MAPPING ==========
+# OTLP SeverityNumber ranges -> severity name (1-4 TRACE ... 21-24 FATAL)
+SEVERITY_NAMES = ["TRACE", "DEBUG", "INFO", "WARN", "ERROR", "FATAL"]
+
+
+def log_fields(attributes, resource_attributes, severity_text: str, severity_number: int, body,
+               time_unix_nano: int) -> dict:
+    """
+    Bridge payload fields for one log record, shared by the /v1/logs receiver
+    and RabbitMQLogRecordExporter so a record maps the same on either path.
+
+    app_info, message_id, event and event_value come from record attributes
+    of the same name, falling back to service.name, LOG_<severity> and the
+    body. event has no fallback: it becomes a metric label, and free-form
+    body text would only fill the overflow series.
+    """
+    severity = (severity_text or "").upper()
+    if not severity and severity_number:
+        severity = SEVERITY_NAMES[min((severity_number - 1) // 4, 5)]
+    if body is None:
+        body = ""
+    elif not isinstance(body, str):
+        body = json.dumps(body, default=str)
+    event = attributes.get("event")
+
+    return {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time_unix_nano / 1e9)) if time_unix_nano else None,
+        "app_info": str(attributes.get("app_info") or resource_attributes.get("service.name", "unknown")),
+        "message_id": str(attributes.get("message_id") or f"LOG_{severity or 'UNSPECIFIED'}"),
+        "event": str(event) if event is not None else None,
+        "event_value": str(attributes.get("event_value") or body),
+    }
@@ -1,11 +1,59 @@
-from fastapi import FastAPI, HTTPException, Response
-from prometheus_client import Counter, Histogram, Gauge, generate_latest
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request, Response
+from prometheus_client import Counter, Histogram, Gauge, REGISTRY, CollectorRegistry, multiprocess
+from prometheus_client.exposition import choose_encoder
+from pydantic import BaseModel, TypeAdapter, ValidationError
+import fcntl
+import gzip
+import json
 import logging
+import os
+import socket
+import sys
 import time
 from typing import Optional
 import uvicorn
-import re
+
+from log_rules import RuleReloader
+from metric_recorder import (
+    BoundChildren, BufferedGauge, BufferedHistogram, CardinalityLimiter, LoopGauge, PeriodicFlusher,
+    ShardedCounter, ShardedHistogram,
+)
+from request_metrics import RequestMetricsMiddleware
+from otlp_logs import decode_logs_request, encode_logs_response, log_fields
+
+# ========== CONFIG ==========
+# Number of uvicorn worker processes. With more than one, metrics are kept in
+# memory-mapped per-worker files under PROMETHEUS_MULTIPROC_DIR and merged
+# when /metrics is scraped.
+WORKERS = int(os.getenv("WORKERS", "1"))
+DEFAULT_MULTIPROC_DIR = "/tmp/prometheus_multiproc"
+# prometheus_client switches to its multiprocess value files when this is set
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+# Series budget for app_events_total (per worker process); error_type and
+# cam_id come from free-form input and fold into an overflow series beyond it
+EVENT_MAX_SERIES = int(os.getenv("EVENT_MAX_SERIES", "1000"))
+CARDINALITY_TOP_K = int(os.getenv("CARDINALITY_TOP_K", "10"))
+# Declarative log-to-metric rules, re-read when the file changes
+RULES_FILE = os.getenv("RULES_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "log_metric_rules.yaml"))
+RULES_RELOAD_INTERVAL = float(os.getenv("RULES_RELOAD_INTERVAL", "5"))
+# Per-route latency / size / in-flight metrics for this service's own endpoints
+REQUEST_METRICS = os.getenv("REQUEST_METRICS", "1") == "1"
+# In multiprocess mode request metrics are buffered in memory and written to
+# the worker's metric files this often
+REQUEST_METRICS_FLUSH_INTERVAL = float(os.getenv("REQUEST_METRICS_FLUSH_INTERVAL", "1.0"))
+# Rendered /metrics output is reused for this long (0 disables the cache)
+METRICS_CACHE_TTL = float(os.getenv("METRICS_CACHE_TTL", "1.0"))
+# Optional push mode: changed series are sent to this Prometheus remote-write
+# endpoint (e.g. http://192.168.1.9:8428/api/v1/write) every interval
+REMOTE_WRITE_URL = os.getenv("REMOTE_WRITE_URL", "")
+REMOTE_WRITE_INTERVAL = float(os.getenv("REMOTE_WRITE_INTERVAL", "15"))
+# Unchanged series are re-sent this often. A resend is only due on the first
+# push at or after it, so RESEND_INTERVAL + INTERVAL must stay below the
+# receiver's lookback (5 minutes in Prometheus) or quiet series go stale
+REMOTE_WRITE_RESEND_INTERVAL = float(os.getenv("REMOTE_WRITE_RESEND_INTERVAL", "120"))
+REMOTE_WRITE_QUEUE_SIZE = int(os.getenv("REMOTE_WRITE_QUEUE_SIZE", "100"))
+REMOTE_WRITE_MAX_SERIES = int(os.getenv("REMOTE_WRITE_MAX_SERIES", "2000"))
+REMOTE_WRITE_JOB = os.getenv("REMOTE_WRITE_JOB", "poc_metric_transform")
 
 app = FastAPI()
 
@@ -24,58 +72,194 @@ class LogData(BaseModel):
     duration_ms: Optional[int] = None
     user_id: Optional[str] = None
 
+# Built once: validates a whole /log/bulk body in a single pass
+LOG_BATCH_ADAPTER = TypeAdapter(list[LogData])
+
 # ========== METRICS DEFINITION ==========
-EVENT_COUNTER = Counter(
-    'app_events_total',
-    'Total count of application events by type and value',
-    ['app_name', 'store', 'filter_type', 'error_type','cam_id']
+def make_counter(name, documentation, labelnames):
+    """
+    Counter recorded by label tuple: per-thread shards merged at scrape time,
+    or bound children of a regular Counter when values live in multiprocess
+    files (custom collectors are not aggregated across workers).
+    """
+    if MULTIPROCESS:
+        return BoundChildren(Counter(name, documentation, labelnames))
+    return ShardedCounter(name, documentation, labelnames)
+
+RULE_HITS = make_counter(
+    'log_rule_hits_total',
+    'Events matched per log-to-metric rule',
+    ['rule']
+)
+
+CARDINALITY_OVERFLOW = Counter(
+    'metric_cardinality_overflow_total',
+    'Events recorded into the overflow series because the series budget was exhausted',
+    ['metric']
+)
+
+# Each worker has its own series budget, so the exposed series can add up
+# across workers: report the sum over live workers, not the largest one
+CARDINALITY_SERIES = Gauge(
+    'metric_cardinality_series',
+    'Number of label series admitted by the cardinality limiters of all live workers',
+    ['metric'],
+    multiprocess_mode='livesum'
 )
 
+# Metrics declared by the rule file: name -> (labelnames, counter, limiter)
+DERIVED_METRICS = {}
+RULE_ENGINE = None
+
+def apply_rules(engine):
+    """Create any newly declared metrics, then switch to the new rules"""
+    global RULE_ENGINE
+    for name, spec in engine.metrics.items():
+        labelnames = tuple(spec["labels"])
+        if name in DERIVED_METRICS:
+            if DERIVED_METRICS[name][0] != labelnames:
+                raise ValueError(f"Metric {name} cannot change labels on reload")
+            continue
+        limiter = CardinalityLimiter(
+            labelnames,
+            limited_labels=spec.get("limited_labels", []),
+            max_series=spec.get("max_series", EVENT_MAX_SERIES),
+            top_k=CARDINALITY_TOP_K,
+            overflow_counter=CARDINALITY_OVERFLOW.labels(metric=name),
+            series_gauge=CARDINALITY_SERIES.labels(metric=name),
+        )
+        counter = make_counter(name, spec.get("help", name), labelnames)
+        DERIVED_METRICS[name] = (labelnames, counter, limiter)
+    RULE_ENGINE = engine
+
+RULES_RELOADER = RuleReloader(RULES_FILE, apply_rules, RULES_RELOAD_INTERVAL)
+RULES_RELOADER.load()
+
 ERROR_COUNTER = Counter(
     'app_errors_total',
     'Total count of application errors',
     ['app_name', 'store', 'filter_type', 'error']
 )
 
-REQUEST_LATENCY = Histogram(
+# Recorded by RequestMetricsMiddleware for every HTTP request into lock-free
+# sharded collectors. In multiprocess mode those are buffers that are flushed
+# into regular metrics, as per-request writes to the metric files cost ~20us
+REQUEST_LABELS = ['route', 'method', 'status']
+LATENCY_BUCKETS = [0.5, 1, 2, 5, 10, 25, 50, 100, 200, 500, 1000, 2000]
+SIZE_BUCKETS = [256, 1024, 4096, 16384, 65536, 262144, 1048576]
+
+def make_histogram(name, documentation, labelnames, buckets):
+    if MULTIPROCESS:
+        return BufferedHistogram(Histogram(name, documentation, labelnames, buckets=buckets), labelnames, buckets)
+    return ShardedHistogram(name, documentation, labelnames, buckets)
+
+REQUEST_LATENCY = make_histogram(
     'api_request_duration_ms',
     'Duration of API requests in milliseconds',
-    ['app_name', 'store', 'filter_type', 'status'],
-    buckets=[50, 100, 200, 500, 1000, 2000]
+    REQUEST_LABELS,
+    LATENCY_BUCKETS
+)
+
+REQUEST_SIZE = make_histogram(
+    'api_request_size_bytes',
+    'Size of API request bodies in bytes',
+    REQUEST_LABELS,
+    SIZE_BUCKETS
+)
+
+RESPONSE_SIZE = make_histogram(
+    'api_response_size_bytes',
+    'Size of API response bodies in bytes',
+    REQUEST_LABELS,
+    SIZE_BUCKETS
 )
 
+if MULTIPROCESS:
+    REQUESTS_IN_FLIGHT = BufferedGauge(Gauge(
+        'api_requests_in_flight',
+        'Number of API requests currently being served',
+        multiprocess_mode='livesum'
+    ))
+else:
+    # Only the event loop thread runs the middleware
+    REQUESTS_IN_FLIGHT = LoopGauge(
+        'api_requests_in_flight',
+        'Number of API requests currently being served'
+    )
+
+if REQUEST_METRICS:
+    app.add_middleware(
+        RequestMetricsMiddleware,
+        latency=REQUEST_LATENCY,
+        request_size=REQUEST_SIZE,
+        response_size=RESPONSE_SIZE,
+        in_flight=REQUESTS_IN_FLIGHT,
+    )
+
+REQUEST_METRICS_FLUSHER = PeriodicFlusher(
+    [REQUEST_LATENCY, REQUEST_SIZE, RESPONSE_SIZE, REQUESTS_IN_FLIGHT],
+    REQUEST_METRICS_FLUSH_INTERVAL,
+) if MULTIPROCESS and REQUEST_METRICS else None
+
+# multiprocess_mode decides how per-worker gauge values are merged
 ACTIVE_APPS = Gauge(
     'active_applications',
     'Number of active applications sending logs',
-    ['app_name', 'store', 'filter_type']
+    ['app_name', 'store', 'filter_type'],
+    multiprocess_mode='livemax'
 )
 
 LAST_EVENT_TIMESTAMP = Gauge(
     'app_last_event_timestamp',
     'Timestamp of last received event per application',
-    ['app_name', 'store', 'filter_type']
+    ['app_name', 'store', 'filter_type'],
+    multiprocess_mode='max'
 )
 
 # ========== HELPER FUNCTIONS ==========
+def record_metrics_batch(batch: list[LogData]):
+    """
+    Run every event through the compiled rules, then record the matches with
+    one cardinality-limiter lock per target metric
+    """
+    engine = RULE_ENGINE
+    matches = {}
+    for log_data in batch:
+        for rule, label_values in engine.evaluate(log_data):
+            RULE_HITS.inc((rule.name,))
+            matches.setdefault(rule.metric, []).append(label_values)
+
+    for name, label_batch in matches.items():
+        _, counter, limiter = DERIVED_METRICS[name]
+        for label_values in limiter.admit_many(label_batch):
+            counter.inc(label_values)
+
+def log_data_from_otlp(record: dict) -> LogData:
+    """Map a decoded OTLP log record onto LogData (see otlp_logs.log_fields)."""
+    fields = log_fields(
+        record["attributes"],
+        record["resource"],
+        record["severity_text"],
+        record["severity_number"],
+        record["body"],
+        record["time_unix_nano"],
+    )
+    # Fields are built here, so skip pydantic validation; LogData.event is a
+    # required string, so a record without one gets an empty event
+    return LogData.model_construct(
+        app_info=fields["app_info"],
+        message_id=fields["message_id"],
+        event=fields["event"] or "",
+        event_value=fields["event_value"],
+        timestamp=fields["timestamp"],
+        duration_ms=None,
+        user_id=None,
+    )
+
 def record_metrics(log_data: LogData):
     """Extract and record metrics from log data"""
-    labels = {
-        'app_name': log_data.app_info,
-        'store' : '1111',
-    }
-    
-    # Count all events
-    if log_data.message_id in 'LOG_ERROR':
-      match = re.search(r":\s*(\d+)", log_data.event_value)
-      extracted_number = match.group(1) if match else None
-      logging.info(f"message contain: {log_data.message_id} : CAM_ID : {extracted_number}")
-      
-      EVENT_COUNTER.labels(
-          **labels,
-          filter_type=log_data.message_id,
-          error_type=log_data.event,
-          cam_id=extracted_number
-      ).inc()
+    # Rules from RULES_FILE decide which events are counted and how
+    record_metrics_batch([log_data])
       
     
     # # Track active applications
@@ -120,19 +304,220 @@ async def handle_log(log_data: LogData):
         logging.error(f"Error processing log: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def scrape_registry():
+    """Registry to expose: merged worker files in multiprocess mode."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """True if Accept-Encoding allows gzip (by name or via *) with a q-value above 0."""
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+    return weights.get("gzip", weights.get("*", 0.0)) > 0
+
+
+# (content_type, gzipped) -> (rendered_at, body)
+_metrics_cache = {}
+
+def render_metrics(accept: str, accept_encoding: str):
+    """
+    Render the registry in the format the scraper asked for (Prometheus text
+    or OpenMetrics), gzip it if accepted, and reuse the result for
+    METRICS_CACHE_TTL seconds.
+    """
+    encoder, content_type = choose_encoder(accept)
+    gzipped = accepts_gzip(accept_encoding)
+    key = (content_type, gzipped)
+
+    now = time.monotonic()
+    cached = _metrics_cache.get(key)
+    if cached is not None and now - cached[0] < METRICS_CACHE_TTL:
+        return cached[1], content_type, gzipped
+
+    body = encoder(scrape_registry())
+    if gzipped:
+        body = gzip.compress(body, compresslevel=6)
+    _metrics_cache[key] = (now, body)
+    return body, content_type, gzipped
+
+
+@app.post("/log/bulk")
+async def handle_log_bulk(request: Request):
+    """
+    Endpoint for receiving a JSON list of application logs. Valid items are
+    recorded even if others fail validation; rejected items are reported by
+    index.
+    """
+    body = await request.body()
+    rejected = []
+    try:
+        batch = LOG_BATCH_ADAPTER.validate_json(body)
+    except ValidationError as e:
+        # Slow path: drop the invalid items and validate the rest again
+        try:
+            raw = json.loads(body)
+        except ValueError:
+            raise HTTPException(status_code=422, detail="Body must be a JSON list of log records")
+        if not isinstance(raw, list):
+            raise HTTPException(status_code=422, detail="Body must be a JSON list of log records")
+
+        errors = {}
+        for err in e.errors():
+            if err["loc"] and isinstance(err["loc"][0], int):
+                errors.setdefault(err["loc"][0], f"{'.'.join(map(str, err['loc'][1:]))}: {err['msg']}")
+        rejected = [{"index": i, "error": msg} for i, msg in sorted(errors.items())]
+        batch = LOG_BATCH_ADAPTER.validate_python([item for i, item in enumerate(raw) if i not in errors])
+
+    try:
+        now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        for log_data in batch:
+            if not log_data.timestamp:
+                log_data.timestamp = now
+
+        record_metrics_batch(batch)
+        logging.info(f"Received {len(batch)} logs in bulk ({len(rejected)} rejected)")
+
+        return {
+            "status": "success" if not rejected else "partial",
+            "accepted": len(batch),
+            "rejected": rejected,
+            "processed_at": time.time()
+        }
+    except Exception as e:
+        logging.error(f"Error processing bulk logs: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/v1/logs")
+async def otlp_logs(request: Request):
+    """OTLP/HTTP logs receiver (protobuf or JSON, optionally gzipped)"""
+    content_type = request.headers.get("content-type", "application/x-protobuf")
+    try:
+        records = decode_logs_request(
+            await request.body(),
+            content_type,
+            request.headers.get("content-encoding", ""),
+        )
+    except Exception as e:
+        logging.error(f"Could not decode OTLP logs request: {e}")
+        raise HTTPException(status_code=400, detail=f"Invalid OTLP logs request: {e}")
+
+    # A record that cannot be mapped is rejected on its own, not the request
+    batch, errors = [], []
+    for record in records:
+        try:
+            batch.append(log_data_from_otlp(record))
+        except Exception as e:
+            errors.append(str(e))
+
+    record_metrics_batch(batch)
+    logging.info(f"Received {len(records)} OTLP log records ({len(errors)} rejected)")
+
+    error_message = f"{len(errors)} log records could not be mapped, first error: {errors[0]}" if errors else ""
+    body, media_type = encode_logs_response(content_type, len(errors), error_message)
+    return Response(content=body, media_type=media_type)
+
 @app.get("/metrics")
-async def metrics():
+async def metrics(request: Request):
     """Prometheus metrics endpoint"""
-    return Response(
-        content=generate_latest(),
-        media_type="text/plain"
+    body, content_type, gzipped = render_metrics(
+        request.headers.get("accept", ""),
+        request.headers.get("accept-encoding", ""),
     )
+    # The body depends on both headers, so caches must key on them
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type=content_type, headers=headers)
+
+@app.get("/cardinality")
+async def cardinality():
+    """Series budget usage and heaviest label values per limited metric"""
+    return {name: limiter.stats() for name, (_, _, limiter) in DERIVED_METRICS.items()}
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+_remote_write_pusher = None
+_remote_write_lock = None
+
+def is_remote_write_leader():
+    """In multiprocess mode only the worker holding the lock file pushes."""
+    global _remote_write_lock
+    if not MULTIPROCESS or _remote_write_lock is not None:
+        return True
+    lock_file = open(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "remote_write.lock"), "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return False
+    _remote_write_lock = lock_file  # held until this worker exits
+    return True
+
+@app.on_event("startup")
+def start_rules_reloader():
+    RULES_RELOADER.start()
+
+@app.on_event("startup")
+def start_request_metrics_flusher():
+    if REQUEST_METRICS_FLUSHER is not None:
+        REQUEST_METRICS_FLUSHER.start()
+
+@app.on_event("startup")
+def start_remote_write():
+    global _remote_write_pusher
+    if not REMOTE_WRITE_URL:
+        return
+    # Imported here so scrape-only deployments do not need python-snappy
+    from remote_write import RemoteWritePusher
+    _remote_write_pusher = RemoteWritePusher(
+        REMOTE_WRITE_URL,
+        scrape_registry(),
+        interval=REMOTE_WRITE_INTERVAL,
+        resend_interval=REMOTE_WRITE_RESEND_INTERVAL,
+        queue_size=REMOTE_WRITE_QUEUE_SIZE,
+        max_series_per_request=REMOTE_WRITE_MAX_SERIES,
+        external_labels={"job": REMOTE_WRITE_JOB, "instance": socket.gethostname()},
+        should_push=is_remote_write_leader,
+    )
+    _remote_write_pusher.start()
+    logging.info(f"📤 Pushing metrics to {REMOTE_WRITE_URL} every {REMOTE_WRITE_INTERVAL}s")
+
+@app.on_event("shutdown")
+def stop_remote_write():
+    if _remote_write_pusher is not None:
+        _remote_write_pusher.stop()
+
+@app.on_event("shutdown")
+def stop_request_metrics_flusher():
+    if REQUEST_METRICS_FLUSHER is not None:
+        REQUEST_METRICS_FLUSHER.stop()
+
+@app.on_event("shutdown")
+def mark_worker_dead():
+    # Drops this worker's live gauge files so they stop being exposed
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
 # ========== MAIN ==========
 if __name__ == "__main__":
     # Configure logging
@@ -141,6 +526,22 @@ if __name__ == "__main__":
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
     
+    if WORKERS > 1:
+        # Stale files from a previous run would be merged into the new counters
+        multiproc_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", DEFAULT_MULTIPROC_DIR)
+        os.makedirs(multiproc_dir, exist_ok=True)
+        for name in os.listdir(multiproc_dir):
+            if name.endswith(".db"):
+                os.remove(os.path.join(multiproc_dir, name))
+
+        # Hand over to the uvicorn CLI: spawned workers would otherwise re-run
+        # this script as __mp_main__ and register every metric twice. The
+        # workers then import prometheus_client with the env var already set.
+        os.execv(sys.executable, [
+            sys.executable, "-m", "uvicorn", "poc_metric_transform:app",
+            "--host", "0.0.0.0", "--port", "5000", "--workers", str(WORKERS),
+        ])
+
     # Start the server
     uvicorn.run(
         app,
@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import pika
+from google.protobuf.json_format import MessageToDict
+from opentelemetry.exporter.otlp.proto.common.metrics_encoder import encode_metrics
+from opentelemetry.sdk.metrics.export import MetricExporter, MetricExportResult
+
+try:
+    from opentelemetry.sdk._logs.export import LogRecordExporter, LogRecordExportResult
+except ImportError:  # SDK releases before the LogRecord* renames
+    from opentelemetry.sdk._logs.export import LogExporter as LogRecordExporter
+    from opentelemetry.sdk._logs.export import LogExportResult as LogRecordExportResult
+
+from otlp_logs import log_fields
+
+RABBITMQ_HOST = "rabbitmq"
+METRIC_QUEUE = "otel-metrics"
+LOG_QUEUE = "logs_queue"
+STORE_ID = os.getenv("STORE_ID", "store_123")
+
+
+# ========== CONNECTION ==========
+class ConfirmedPublisher:
+    """
+    One long-lived connection with a publisher-confirm channel to a durable
+    queue (declared like log-export-rabbitmq.py does). publish() returns
+    once the broker has confirmed the message, reconnecting once if the
+    connection was lost in between.
+
+    pika's BlockingConnection is not thread-safe, so calls are serialized.
+    """
+
+    def __init__(self, queue: str, host: str = RABBITMQ_HOST, port: int = 5672, heartbeat: int = 60):
+        self.queue = queue
+        self.parameters = pika.ConnectionParameters(host=host, port=port, heartbeat=heartbeat)
+        self._connection = None
+        self._channel = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._connection = pika.BlockingConnection(self.parameters)
+        self._channel = self._connection.channel()
+        self._channel.queue_declare(queue=self.queue, durable=True)
+        self._channel.confirm_delivery()
+
+    def _publish_once(self, body: bytes):
+        if self._connection is None or not self._connection.is_open:
+            self._connect()
+        else:
+            # Answer heartbeats that arrived since the last export
+            self._connection.process_data_events(0)
+        # Raises if the broker nacks or cannot route the message
+        self._channel.basic_publish(
+            exchange="",
+            routing_key=self.queue,
+            body=body,
+            properties=pika.BasicProperties(content_type="application/json", delivery_mode=2),
+            mandatory=True,
+        )
+
+    def publish(self, body: bytes):
+        with self._lock:
+            try:
+                self._publish_once(body)
+            except (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError) as e:
+                logging.warning(f"RabbitMQ connection lost ({e!r}), reconnecting...")
+                self.close_unlocked()
+                self._publish_once(body)
+
+    def close_unlocked(self):
+        try:
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+        except Exception:
+            pass
+        self._connection = self._channel = None
+
+    def close(self):
+        with self._lock:
+            self.close_unlocked()
+
+
+# ========== METRICS ==========
+def metrics_to_otlp_json(metrics_data) -> bytes:
+    """
+    Whole MetricsData as one OTLP/JSON ExportMetricsServiceRequest, the same
+    encoding the collector's rabbitmq exporter writes to otel-metrics
+    (camelCase fields, int64 as strings, enums as integers).
+    """
+    request = encode_metrics(metrics_data)
+    return json.dumps(MessageToDict(request, use_integers_for_enums=True), separators=(",", ":")).encode("utf-8")
+
+
+class RabbitMQMetricExporter(MetricExporter):
+    """
+    Publishes each export cycle's metrics as a single OTLP/JSON message on
+    the otel-metrics queue, so apps can feed log-export-rabbitmq.py without
+    going through the collector:
+
+        reader = PeriodicExportingMetricReader(RabbitMQMetricExporter())
+    """
+
+    def __init__(self, host: str = RABBITMQ_HOST, queue: str = METRIC_QUEUE,
+                 preferred_temporality=None, preferred_aggregation=None):
+        super().__init__(preferred_temporality=preferred_temporality,
+                         preferred_aggregation=preferred_aggregation)
+        self._publisher = ConfirmedPublisher(queue, host)
+
+    def export(self, metrics_data, timeout_millis: float = 10_000, **kwargs) -> MetricExportResult:
+        if not metrics_data.resource_metrics:
+            return MetricExportResult.SUCCESS
+        try:
+            self._publisher.publish(metrics_to_otlp_json(metrics_data))
+            return MetricExportResult.SUCCESS
+        except Exception as e:
+            logging.error(f"❌ Could not publish metrics to RabbitMQ: {e}")
+            return MetricExportResult.FAILURE
+
+    def force_flush(self, timeout_millis: float = 10_000) -> bool:
+        # Every export is confirmed before it returns
+        return True
+
+    def shutdown(self, timeout_millis: float = 30_000, **kwargs) -> None:
+        self._publisher.close()
+
+
+# ========== LOGS ==========
+def log_payload(record, resource, store_id: str, index: int) -> dict:
+    """
+    One log record in the payload schema log-export-rabbitmq.py's /log
+    endpoint publishes to logs_queue, mapped like the /v1/logs receiver
+    does (otlp_logs.log_fields).
+    """
+    timestamp_ns = record.timestamp or record.observed_timestamp or time.time_ns()
+    fields = log_fields(
+        record.attributes or {},
+        resource.attributes,
+        record.severity_text,
+        record.severity_number.value if record.severity_number is not None else 0,
+        record.body,
+        timestamp_ns,
+    )
+    return {
+        "store_id": store_id,
+        "timestamp": fields["timestamp"],
+        "app_info": fields["app_info"],
+        "message_id": fields["message_id"],
+        "event": fields["event"],
+        "event_value": fields["event_value"],
+        "insert_id": f"unique_message_id_{store_id}_{timestamp_ns}_{index}",
+    }
+
+
+class RabbitMQLogRecordExporter(LogRecordExporter):
+    """
+    Publishes each batch from BatchLogRecordProcessor as one JSON array of
+    bridge payloads on logs_queue, replacing one HTTP POST to /log (and one
+    republish) per event:
+
+        BatchLogRecordProcessor(RabbitMQLogRecordExporter())
+    """
+
+    def __init__(self, host: str = RABBITMQ_HOST, queue: str = LOG_QUEUE, store_id: str = STORE_ID):
+        self.store_id = store_id
+        self._publisher = ConfirmedPublisher(queue, host)
+
+    def export(self, batch) -> LogRecordExportResult:
+        if not batch:
+            return LogRecordExportResult.SUCCESS
+        payloads = []
+        for index, item in enumerate(batch):
+            # Newer SDKs carry the resource next to the record
+            resource = getattr(item, "resource", None) or item.log_record.resource
+            payloads.append(log_payload(item.log_record, resource, self.store_id, index))
+        try:
+            self._publisher.publish(json.dumps(payloads, default=str).encode("utf-8"))
+            return LogRecordExportResult.SUCCESS
+        except Exception as e:
+            logging.error(f"❌ Could not publish {len(payloads)} log records to RabbitMQ: {e}")
+            return LogRecordExportResult.FAILURE
+
+    def force_flush(self, timeout_millis: int = 30_000) -> bool:
+        return True
+
+    def shutdown(self):
+        self._publisher.close()
@@ -1,8 +1,7 @@
+import os
 import time
 import random
 import logging
-import json
-import pika
 
 from opentelemetry import metrics
 from opentelemetry.sdk.resources import Resource
@@ -14,6 +13,8 @@ from opentelemetry.sdk._logs import LoggerProvider, LoggingHandler
 from opentelemetry.exporter.otlp.proto.http._log_exporter import OTLPLogExporter
 from opentelemetry.sdk._logs.export import BatchLogRecordProcessor
 
+from rabbitmq_exporter import RabbitMQLogRecordExporter, RabbitMQMetricExporter
+
 # ------------------ Resource Metadata ------------------ #
 resource = Resource(attributes={
     "service.name": "metric-generator",
@@ -25,16 +26,17 @@ resource = Resource(attributes={
 rabbitmq_host = "localhost"  # or "rabbitmq" if using Docker Compose
 queue_name = "otel-metrics"
 
-rabbit_conn = pika.BlockingConnection(pika.ConnectionParameters(host=rabbitmq_host))
-rabbit_channel = rabbit_conn.channel()
-rabbit_channel.queue_declare(queue=queue_name)
-
-def send_metric_to_rabbitmq(metric_data: dict):
-    body = json.dumps(metric_data)
-    rabbit_channel.basic_publish(exchange='', routing_key=queue_name, body=body)
+# "rabbitmq" publishes straight to the bridge's queues, "otlp" goes through
+# the collector (whose metrics/custom pipeline feeds the same queue). Only one
+# path may be active, otherwise every data point reaches BigQuery twice.
+EXPORT_MODE = os.getenv("EXPORT_MODE", "rabbitmq")
 
 # ------------------ Metrics Setup ------------------ #
-metric_exporter = OTLPMetricExporter(endpoint="http://otel-collector:4318/v1/metrics")
+if EXPORT_MODE == "otlp":
+    metric_exporter = OTLPMetricExporter(endpoint="http://otel-collector:4318/v1/metrics")
+else:
+    # One OTLP message per export cycle straight to the bridge's queue
+    metric_exporter = RabbitMQMetricExporter(host=rabbitmq_host, queue=queue_name)
 reader = PeriodicExportingMetricReader(metric_exporter)
 metrics_provider = MeterProvider(resource=resource, metric_readers=[reader])
 metrics.set_meter_provider(metrics_provider)
@@ -44,7 +46,11 @@ request_counter = meter.create_counter("app_requests_total", description="Total
 error_counter = meter.create_counter("app_errors_total", description="Total errors")
 
 # ------------------ Logging Setup ------------------ #
-log_exporter = OTLPLogExporter(endpoint="http://otel-collector:4318/v1/logs")
+if EXPORT_MODE == "otlp":
+    log_exporter = OTLPLogExporter(endpoint="http://otel-collector:4318/v1/logs")
+else:
+    # Batches of bridge-format payloads straight to logs_queue
+    log_exporter = RabbitMQLogRecordExporter(host=rabbitmq_host)
 log_processor = BatchLogRecordProcessor(log_exporter)
 logger_provider = LoggerProvider(resource=resource)
 logger_provider.add_log_record_processor(log_processor)
@@ -64,28 +70,14 @@ try:
         request_counter.add(1, attributes=attributes)
         logger.info("Request processed successfully")
 
-        # Send request metric to RabbitMQ
-        send_metric_to_rabbitmq({
-            "metric": "app_requests_total",
-            "value": 1,
-            "attributes": attributes,
-            "timestamp": time.time()
-        })
-
         if random.random() < 0.2:
             error_counter.add(1, attributes=attributes)
             logger.error("⚠️ Simulated error occurred")
 
-            send_metric_to_rabbitmq({
-                "metric": "app_errors_total",
-                "value": 1,
-                "attributes": attributes,
-                "timestamp": time.time()
-            })
-
         time.sleep(2)
 
 except KeyboardInterrupt:
     print("Stopped generating metrics and logs.")
-    rabbit_conn.close()
+    metrics_provider.shutdown()
+    logger_provider.shutdown()
 
@@ -0,0 +1,255 @@
+import logging
+import math
+import struct
+import threading
+import time
+from collections import deque
+
+import requests
+import snappy
+
+# ========== PROTOBUF ==========
+# Prometheus remote-write 1.0 (prompb), encoded by hand - only these messages
+# are needed:
+#   WriteRequest { repeated TimeSeries timeseries = 1; }
+#   TimeSeries   { repeated Label labels = 1; repeated Sample samples = 2; }
+#   Label        { string name = 1; string value = 2; }
+#   Sample       { double value = 1; int64 timestamp = 2; }
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    n &= 0xFFFFFFFFFFFFFFFF  # negative int64 as two's complement
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _field(number: int, payload: bytes) -> bytes:
+    """Length-delimited field."""
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def encode_write_request(series) -> bytes:
+    """
+    series: iterable of (labels, value, timestamp_ms), labels being a tuple of
+    (name, value) pairs that includes __name__.
+    """
+    out = []
+    for labels, value, timestamp_ms in series:
+        body = b"".join(
+            _field(1, _field(1, name.encode()) + _field(2, label_value.encode()))
+            for name, label_value in sorted(labels)
+        )
+        sample = b"\x09" + struct.pack("<d", value) + b"\x10" + _varint(timestamp_ms)
+        out.append(_field(1, body + _field(2, sample)))
+    return b"".join(out)
+
+
+def _read_varint(buf: bytes, pos: int):
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _read_fields(buf: bytes):
+    """Yield (field number, value) for a message's fields."""
+    pos = 0
+    while pos < len(buf):
+        key, pos = _read_varint(buf, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == 1:
+            value, pos = buf[pos:pos + 8], pos + 8
+        elif wire_type == 2:
+            length, pos = _read_varint(buf, pos)
+            value, pos = buf[pos:pos + length], pos + length
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type}")
+        yield number, value
+
+
+def decode_write_request(body: bytes) -> list[tuple[dict, list[tuple[float, int]]]]:
+    """Inverse of encode_write_request: [(labels, [(value, timestamp_ms)])]."""
+    result = []
+    for _, ts in _read_fields(body):
+        labels, samples = {}, []
+        for number, value in _read_fields(ts):
+            if number == 1:
+                label = dict(_read_fields(value))
+                labels[label.get(1, b"").decode()] = label.get(2, b"").decode()
+            elif number == 2:
+                sample = dict(_read_fields(value))
+                timestamp = sample.get(2, 0)
+                if timestamp >= 1 << 63:
+                    timestamp -= 1 << 64
+                samples.append((struct.unpack("<d", sample.get(1, b"\0" * 8))[0], timestamp))
+        result.append((labels, samples))
+    return result
+
+
+# ========== REGISTRY SNAPSHOT ==========
+def snapshot_registry(registry) -> dict:
+    """{(sample name, sorted labels): value} for every sample in the registry."""
+    snapshot = {}
+    for family in registry.collect():
+        for sample in family.samples:
+            # Creation timestamps are not sent over remote write
+            if sample.name.endswith("_created"):
+                continue
+            key = (sample.name, tuple(sorted(sample.labels.items())))
+            snapshot[key] = sample.value
+    return snapshot
+
+
+# ========== PUSHER ==========
+# Prometheus' default lookback: a series without a sample for this long drops
+# out of instant queries
+LOOKBACK_SECONDS = 300
+
+
+class RemoteWritePusher:
+    """
+    Background thread that snapshots a registry every `interval` seconds and
+    pushes the series whose value changed since the previous snapshot.
+    Every series is re-sent on the first push at least `resend_interval`
+    seconds after the last full one, so resend_interval + interval must stay
+    below the receiver's lookback for unchanged series to stay visible.
+    `external_labels` are added to every series that does not already have
+    a label of the same name.
+
+    Batches wait in a bounded queue: while the endpoint is down they are
+    retried oldest first with exponential backoff, and once `queue_size` is
+    reached the oldest batch is dropped. 4xx responses other than 429 are
+    not retried, as the remote-write spec asks.
+    """
+
+    def __init__(self, url: str, registry, interval: float = 15.0, resend_interval: float = 120.0,
+                 queue_size: int = 100, max_series_per_request: int = 2000, timeout: float = 10.0,
+                 external_labels: dict = None, should_push=None):
+        self.url = url
+        self.registry = registry
+        self.interval = interval
+        self.resend_interval = resend_interval
+        self.max_series_per_request = max_series_per_request
+        self.timeout = timeout
+        self.external_labels = tuple(sorted((external_labels or {}).items()))
+        self._external_names = frozenset(name for name, _ in self.external_labels)
+        if resend_interval + interval >= LOOKBACK_SECONDS:
+            logging.warning(f"Remote write resends every {resend_interval:.0f}-{resend_interval + interval:.0f}s, "
+                            f"unchanged series will go stale after the {LOOKBACK_SECONDS}s lookback")
+        # Multiprocess deployments push from one worker only
+        self.should_push = should_push or (lambda: True)
+
+        self._queue = deque(maxlen=queue_size)
+        self._sent = {}  # series key -> last value handed to the queue
+        self._last_full_push = 0.0
+        self._session = requests.Session()
+        self._session.headers.update({
+            "Content-Encoding": "snappy",
+            "Content-Type": "application/x-protobuf",
+            "X-Prometheus-Remote-Write-Version": "0.1.0",
+        })
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"samples_sent": 0, "batches_sent": 0, "batches_failed": 0, "batches_dropped": 0}
+
+    # --- snapshot / queue ---
+    def collect_changes(self, now: float = None):
+        """Queue the series that changed (or all of them when a resend is due)."""
+        now = time.time() if now is None else now
+        snapshot = snapshot_registry(self.registry)
+        full = now - self._last_full_push >= self.resend_interval
+        if full:
+            self._last_full_push = now
+
+        timestamp_ms = int(now * 1000)
+        changed = []
+        for key, value in snapshot.items():
+            previous = self._sent.get(key)
+            # NaN != NaN, so compare those separately
+            if full or previous is None or (previous != value and not (math.isnan(previous) and math.isnan(value))):
+                name, labels = key
+                changed.append(((("__name__", name),) + labels + self._external_labels_for(labels), value, timestamp_ms))
+                self._sent[key] = value
+
+        # Series that disappeared (e.g. dead worker gauges) are forgotten so
+        # they are pushed again if they come back
+        for key in self._sent.keys() - snapshot.keys():
+            del self._sent[key]
+
+        for i in range(0, len(changed), self.max_series_per_request):
+            if len(self._queue) == self._queue.maxlen:
+                self.stats["batches_dropped"] += 1
+            self._queue.append(changed[i:i + self.max_series_per_request])
+        return len(changed)
+
+    def _external_labels_for(self, labels):
+        """External labels the series does not set itself (duplicate names are rejected)."""
+        if self._external_names.isdisjoint(name for name, _ in labels):
+            return self.external_labels
+        own = {name for name, _ in labels}
+        return tuple(label for label in self.external_labels if label[0] not in own)
+
+    def flush(self) -> bool:
+        """Send queued batches in order; False if the endpoint is unavailable."""
+        while self._queue:
+            batch = self._queue[0]
+            body = snappy.compress(encode_write_request(batch))
+            try:
+                response = self._session.post(self.url, data=body, timeout=self.timeout)
+                status = response.status_code
+            except requests.RequestException as e:
+                logging.warning(f"Remote write to {self.url} failed: {e}")
+                status = None
+
+            if status is not None and status < 300:
+                self.stats["batches_sent"] += 1
+                self.stats["samples_sent"] += len(batch)
+            elif status is not None and 400 <= status < 500 and status != 429:
+                # Malformed for the receiver, retrying would not help
+                logging.error(f"Remote write rejected a batch of {len(batch)} series: {status} {response.text[:200]}")
+                self.stats["batches_dropped"] += 1
+            else:
+                self.stats["batches_failed"] += 1
+                return False
+            self._queue.popleft()
+        return True
+
+    # --- thread ---
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the loop and make a last attempt to deliver what is queued."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.timeout)
+        if self.should_push():
+            self.collect_changes()
+            self.flush()
+
+    def _run(self):
+        backoff = self.interval
+        while not self._stop.wait(backoff):
+            try:
+                if not self.should_push():
+                    backoff = self.interval
+                    continue
+                self.collect_changes()
+                if self.flush():
+                    backoff = self.interval
+                else:
+                    # Keep snapshotting, but retry less often while it is down
+                    backoff = min(backoff * 2, self.interval * 8)
+                    logging.warning(f"Remote write: {len(self._queue)} batches queued, retrying in {backoff:.0f}s")
+            except Exception as e:
+                logging.error(f"Remote write push failed: {e}")
@@ -0,0 +1,56 @@
+from time import perf_counter
+
+
+class RequestMetricsMiddleware:
+    """
+    Pure ASGI middleware recording per-route latency (ms), request/response
+    size and in-flight requests, using only monotonic clocks.
+
+    latency / request_size / response_size take observe(label_values, value)
+    with label values (route, method, status): ShardedHistogram, or
+    BoundChildren over a Histogram. in_flight needs inc()/dec().
+
+    The route is the matched path template (e.g. "/log"), so raw URLs never
+    become label values; unmatched requests are recorded as "unmatched".
+    """
+
+    def __init__(self, app, latency, request_size, response_size, in_flight):
+        self.app = app
+        self.latency = latency
+        self.request_size = request_size
+        self.response_size = response_size
+        self.in_flight = in_flight
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        sent = 0
+
+        async def send_wrapper(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        self.in_flight.inc()
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed_ms = (perf_counter() - start) * 1000
+            self.in_flight.dec()
+
+            # The router stores the matched route in the (shared) scope
+            route = scope.get("route")
+            key = (route.path if route is not None else "unmatched", scope["method"], status)
+            self.latency.observe(key, elapsed_ms)
+            self.response_size.observe(key, sent)
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    self.request_size.observe(key, int(value))
+                    break
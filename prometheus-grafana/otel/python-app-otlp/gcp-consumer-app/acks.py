@@ -0,0 +1,33 @@
+import threading
+
+
+class PendingAck:
+    """
+    Acks a Pub/Sub message once every stage holding its rows has released
+    it, or nacks it if any of them failed to store its rows.
+
+    The creator holds the first reference; a stage that keeps rows for later
+    (e.g. an open rollup window) takes another one with hold() and gives it
+    back with release(ok) once those rows are written.
+    """
+
+    def __init__(self, message):
+        self.message = message
+        self._refs = 1
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def hold(self):
+        with self._lock:
+            self._refs += 1
+
+    def release(self, ok: bool = True):
+        with self._lock:
+            self._refs -= 1
+            self._failed = self._failed or not ok
+            if self._refs:
+                return
+        if self._failed:
+            self.message.nack()
+        else:
+            self.message.ack()
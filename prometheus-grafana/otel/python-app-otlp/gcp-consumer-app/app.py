@@ -1,21 +1,105 @@
+import os
 import json
+import random
+import threading
+import time
+import uuid
 from datetime import datetime, timezone
 from google.cloud import pubsub_v1
 from google.cloud import bigquery
 
+from acks import PendingAck
+from rollup import MetricRollup
+from file_sink import RollingParquetSink, LocalDirectoryUploader, BigQueryLoadUploader
+
 PROJECT_ID = os.getenv("PROJECT_ID", "np-store-sim")
 SUBSCRIPTION_ID = os.getenv("SUBSCRIPTION_ID", "otel_metrics_subscription")
 BQ_DATASET = os.getenv("BQ_DATASET", "otel_metrics")
 METRIC_TABLE = os.getenv("METRIC_TABLE", "otel_metrics_table")
 LOG_TABLE = os.getenv("LOG_TABLE", "otel_logs_table")
+ROLLUP_TABLE = os.getenv("ROLLUP_TABLE", "otel_metrics_rollup_table")
+
+# Optional rollup stage: 0 disables it, otherwise metric rows are aggregated
+# into windows of this many seconds before they reach BigQuery
+ROLLUP_WINDOW_SECONDS = int(os.getenv("ROLLUP_WINDOW_SECONDS", "0"))
+ROLLUP_AGGREGATIONS = os.getenv("ROLLUP_AGGREGATIONS", "count,sum,min,max,last").split(",")
+ROLLUP_VALUE_AGG = os.getenv("ROLLUP_VALUE_AGG", "last")
+ROLLUP_GRACE_SECONDS = float(os.getenv("ROLLUP_GRACE_SECONDS", "30"))
+ROLLUP_FLUSH_INTERVAL = float(os.getenv("ROLLUP_FLUSH_INTERVAL", "10"))
+# Sink mode: "streaming" uses insert_rows_json, "files" writes rolling Parquet
+# files that are handed to an uploader ("bigquery" load jobs or "local" dir)
+SINK_MODE = os.getenv("SINK_MODE", "streaming")
+FILE_SINK_DIR = os.getenv("FILE_SINK_DIR", "/data/sink")
+FILE_SINK_MAX_BYTES = int(os.getenv("FILE_SINK_MAX_BYTES", str(128 * 1024 * 1024)))
+FILE_SINK_MAX_AGE_SECONDS = float(os.getenv("FILE_SINK_MAX_AGE_SECONDS", "60"))
+FILE_SINK_ROW_GROUP_ROWS = int(os.getenv("FILE_SINK_ROW_GROUP_ROWS", "10000"))
+FILE_SINK_UPLOADER = os.getenv("FILE_SINK_UPLOADER", "bigquery")
+FILE_SINK_UPLOAD_DIR = os.getenv("FILE_SINK_UPLOAD_DIR", "/data/uploaded")
+FILE_SINK_UPLOAD_BACKOFF_SECONDS = float(os.getenv("FILE_SINK_UPLOAD_BACKOFF_SECONDS", "5"))
+FILE_SINK_UPLOAD_BACKOFF_MAX_SECONDS = float(os.getenv("FILE_SINK_UPLOAD_BACKOFF_MAX_SECONDS", "300"))
+FILE_SINK_UPLOAD_MAX_ATTEMPTS = int(os.getenv("FILE_SINK_UPLOAD_MAX_ATTEMPTS", "10"))
+
+# How nested attributes/resource (schema_version 2 messages) are stored:
+# "json" -> BigQuery JSON columns, "kv" -> REPEATED STRUCT<key STRING, value STRING>
+BQ_ATTRIBUTE_COLUMNS = os.getenv("BQ_ATTRIBUTE_COLUMNS", "json")
+
+# Streaming insert retries: only failed row indices are resent, rows rejected
+# for a non-transient reason are quarantined instead of retried
+INSERT_MAX_ATTEMPTS = int(os.getenv("INSERT_MAX_ATTEMPTS", "5"))
+INSERT_BACKOFF_SECONDS = float(os.getenv("INSERT_BACKOFF_SECONDS", "0.5"))
+INSERT_BACKOFF_MAX_SECONDS = float(os.getenv("INSERT_BACKOFF_MAX_SECONDS", "30"))
+QUARANTINE_FILE = os.getenv("QUARANTINE_FILE", "/data/quarantine/bq_rejected_rows.jsonl")
+QUARANTINE_TABLE = os.getenv("QUARANTINE_TABLE", "")  # optional side table
+
+# Row error reasons worth retrying (https://cloud.google.com/bigquery/docs/error-messages)
+RETRYABLE_REASONS = {"stopped", "backendError", "internalError", "timeout", "rateLimitExceeded"}
+
+# Messages held un-acked by open rollup windows or open sink files count
+# against this limit; the file sink holds up to half of it before rolling
+MAX_OUTSTANDING_MESSAGES = int(os.getenv("MAX_OUTSTANDING_MESSAGES", "20000" if SINK_MODE == "files" else "1000"))
 
 # Two tables: one for metrics, one for logs
 BQ_TABLE_METRICS = f"{PROJECT_ID}.{BQ_DATASET}.{METRIC_TABLE}"
 BQ_TABLE_LOGS = f"{PROJECT_ID}.{BQ_DATASET}.{LOG_TABLE}"
+BQ_TABLE_ROLLUP = f"{PROJECT_ID}.{BQ_DATASET}.{ROLLUP_TABLE}"
+BQ_TABLE_QUARANTINE = f"{PROJECT_ID}.{BQ_DATASET}.{QUARANTINE_TABLE}" if QUARANTINE_TABLE else None
 
 # Initialize BigQuery client
 bq_client = bigquery.Client(project=PROJECT_ID)
 
+file_sink = None
+if SINK_MODE == "files":
+    if FILE_SINK_UPLOADER == "local":
+        uploader = LocalDirectoryUploader(FILE_SINK_UPLOAD_DIR)
+    else:
+        uploader = BigQueryLoadUploader(bq_client, {
+            METRIC_TABLE: BQ_TABLE_METRICS,
+            LOG_TABLE: BQ_TABLE_LOGS,
+            ROLLUP_TABLE: BQ_TABLE_ROLLUP,
+        })
+    file_sink = RollingParquetSink(
+        FILE_SINK_DIR,
+        uploader,
+        max_bytes=FILE_SINK_MAX_BYTES,
+        max_age_seconds=FILE_SINK_MAX_AGE_SECONDS,
+        row_group_rows=FILE_SINK_ROW_GROUP_ROWS,
+        upload_backoff_seconds=FILE_SINK_UPLOAD_BACKOFF_SECONDS,
+        upload_backoff_max_seconds=FILE_SINK_UPLOAD_BACKOFF_MAX_SECONDS,
+        upload_max_attempts=FILE_SINK_UPLOAD_MAX_ATTEMPTS,
+        # Rows with a timestamp the file schema can't hold
+        quarantine=lambda rejected, table: quarantine_rows(rejected, table),
+        max_held_acks=MAX_OUTSTANDING_MESSAGES // 2,
+    )
+
+rollup = None
+if ROLLUP_WINDOW_SECONDS > 0:
+    rollup = MetricRollup(
+        ROLLUP_WINDOW_SECONDS,
+        aggregations=[a.strip() for a in ROLLUP_AGGREGATIONS if a.strip()],
+        value_agg=ROLLUP_VALUE_AGG,
+        grace_seconds=ROLLUP_GRACE_SECONDS,
+    )
+
 # Convert nanoseconds -> BigQuery TIMESTAMP
 def convert_to_bq_ts(nano_str: str) -> str:
     """Convert nanoseconds to BigQuery-compatible TIMESTAMP string (UTC)."""
@@ -23,37 +107,95 @@ def convert_to_bq_ts(nano_str: str) -> str:
     dt = datetime.fromtimestamp(ts_int / 1e9, tz=timezone.utc)
     return dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
 
+# Nested attributes are passed through as-is; legacy JSON strings stay strings
+def attribute_column(value):
+    if not isinstance(value, dict):
+        return value
+    if BQ_ATTRIBUTE_COLUMNS == "kv":
+        return [
+            {"key": k, "value": v if isinstance(v, str) else json.dumps(v)}
+            for k, v in value.items()
+        ]
+    return value
+
+
 # Prepare schema-aware rows
-def parse_message(message_data: str):
-    try:
-        records = json.loads(message_data)
+def metric_row(rec: dict) -> dict:
+    return {
+        "store_id": rec.get("store_id"),
+        "metric_name": rec.get("metric_name"),
+        "timestamp": convert_to_bq_ts(rec.get("timestamp")),
+        "value": float(rec["value"]) if rec.get("value") not in (None, "None", "") else None,
+        "attributes": attribute_column(rec.get("attributes", "{}")),
+        "resource": attribute_column(rec.get("resource", "{}")),
+    }
+
+
+def log_row(rec: dict) -> dict:
+    return {
+        "store_id": rec.get("store_id"),
+        "timestamp": rec.get("timestamp"),
+        "app_info": rec.get("app_info"),
+        "message_id": rec.get("message_id"),
+        "event": rec.get("event"),
+        "event_value": rec.get("event_value"),
+        "insert_id": rec.get("insert_id")
+    }
 
-        # If it's a single dict, wrap in list
-        if isinstance(records, dict):
-            records = [records]
+
+def decode_records(message_data):
+    records = json.loads(message_data)
+
+    # If it's a single dict, wrap in list
+    if isinstance(records, dict):
+        records = [records]
+    return records
+
+
+# Table-specific decoders, selected by the "record_type" message attribute
+def decode_metrics(message_data):
+    return [metric_row(rec) for rec in decode_records(message_data)], []
+
+
+def decode_logs(message_data):
+    return [], [log_row(rec) for rec in decode_records(message_data)]
+
+
+# (record_type, schema_version, encoding) -> decoder
+DECODERS = {
+    ("metric", "1", "json"): decode_metrics,
+    ("metric", "2", "json"): decode_metrics,  # nested attributes/resource
+    ("log", "1", "json"): decode_logs,
+}
+
+
+def parse_message(message_data, attributes=None):
+    """
+    Split a Pub/Sub payload into (metric_rows, log_rows).
+
+    Messages published with record_type/schema_version/encoding attributes go
+    straight to their decoder; older messages without attributes fall back to
+    sniffing each record for "metric_name".
+    """
+    try:
+        if attributes and "record_type" in attributes:
+            key = (
+                attributes.get("record_type"),
+                attributes.get("schema_version", "1"),
+                attributes.get("encoding", "json"),
+            )
+            decoder = DECODERS.get(key)
+            if decoder is not None:
+                return decoder(message_data)
+            print(f"⚠️ No decoder for {key}, inspecting records")
 
         metric_rows, log_rows = [], []
 
-        for rec in records:
+        for rec in decode_records(message_data):
             if rec.get("metric_name"):  # Metrics
-                metric_rows.append({
-                    "store_id": rec.get("store_id"),
-                    "metric_name": rec.get("metric_name"),
-                    "timestamp": convert_to_bq_ts(rec.get("timestamp")),
-                    "value": float(rec["value"]) if rec.get("value") not in (None, "None", "") else None,
-                    "attributes": rec.get("attributes", "{}"),
-                    "resource": rec.get("resource", "{}"),
-                })
+                metric_rows.append(metric_row(rec))
             else:  # Logs
-                log_rows.append({
-                    "store_id": rec.get("store_id"),
-                    "timestamp": rec.get("timestamp"),
-                    "app_info": rec.get("app_info"),
-                    "message_id": rec.get("message_id"),
-                    "event": rec.get("event"),
-                    "event_value": rec.get("event_value"),
-                    "insert_id": rec.get("insert_id")
-                })
+                log_rows.append(log_row(rec))
 
         return metric_rows, log_rows
 
@@ -61,40 +203,181 @@ def parse_message(message_data: str):
         print(f"❌ Failed to parse message: {e}")
         return [], []
 
+# Park rows BigQuery will not accept, so they can be inspected and replayed
+_quarantine_lock = threading.Lock()
+
+def quarantine_rows(rejected, table_ref):
+    """Write (row, errors) pairs to the side table if configured, else to QUARANTINE_FILE."""
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    entries = [
+        {"table": table_ref, "row": json.dumps(row), "errors": json.dumps(errors), "quarantined_at": now}
+        for row, errors in rejected
+    ]
+
+    if BQ_TABLE_QUARANTINE:
+        try:
+            if not bq_client.insert_rows_json(BQ_TABLE_QUARANTINE, entries):
+                print(f"☣️ Quarantined {len(entries)} rows from {table_ref} into {BQ_TABLE_QUARANTINE}")
+                return
+        except Exception as e:
+            print(f"❌ Quarantine table insert failed, falling back to file: {e}")
+
+    os.makedirs(os.path.dirname(QUARANTINE_FILE), exist_ok=True)
+    with _quarantine_lock, open(QUARANTINE_FILE, "a") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+    print(f"☣️ Quarantined {len(entries)} rows from {table_ref} into {QUARANTINE_FILE}")
+
+
 # Insert into BigQuery
-def insert_to_bq(rows, table_ref):
+def insert_to_bq(rows, table_ref) -> bool:
+    """
+    Stream rows into BigQuery, resending only the failed row indices with
+    exponential backoff. Returns True once every row is either inserted or
+    quarantined, False if rows could not be stored anywhere.
+    """
     if not rows:
-        return
+        return True
 
-    errors = bq_client.insert_rows_json(table_ref, rows)
-    if errors:
-        print(f"❌ BigQuery insert errors into {table_ref}: {errors}")
-    else:
-        print(f"✅ Inserted {len(rows)} rows into {table_ref}")
+    # One id per row, kept across retries so a resent row deduplicates against
+    # an earlier success. The payload's insert_id is not reused: the bridge
+    # builds it per store and second, so distinct rows can share it
+    pending = [(row, str(uuid.uuid4())) for row in rows]
+    attempt = quarantined = 0
+
+    try:
+        while pending:
+            attempt += 1
+            try:
+                errors = bq_client.insert_rows_json(
+                    table_ref, [row for row, _ in pending], row_ids=[row_id for _, row_id in pending]
+                )
+            except Exception as e:
+                errors = [
+                    {"index": i, "errors": [{"reason": "backendError", "message": str(e)}]}
+                    for i in range(len(pending))
+                ]
+
+            if not errors:
+                break
+
+            retry, poison = [], []
+            for err in errors:
+                row_errors = err.get("errors", [])
+                entry = pending[err["index"]]
+                if all(e.get("reason") in RETRYABLE_REASONS for e in row_errors):
+                    retry.append((entry, row_errors))
+                else:
+                    poison.append((entry[0], row_errors))
+
+            if poison:
+                print(f"❌ {len(poison)} rows rejected by {table_ref}: {poison[0][1]}")
+                quarantine_rows(poison, table_ref)
+                quarantined += len(poison)
+
+            if retry and attempt >= INSERT_MAX_ATTEMPTS:
+                print(f"❌ Retry budget exhausted for {len(retry)} rows into {table_ref}")
+                quarantine_rows([(entry[0], errs) for entry, errs in retry], table_ref)
+                quarantined += len(retry)
+                retry = []
+
+            pending = [entry for entry, _ in retry]
+            if pending:
+                delay = min(INSERT_BACKOFF_MAX_SECONDS, INSERT_BACKOFF_SECONDS * 2 ** (attempt - 1))
+                print(f"🔁 Retrying {len(pending)} rows into {table_ref} in {delay:.1f}s (attempt {attempt})")
+                time.sleep(delay * random.uniform(0.5, 1.0))
+    except Exception as e:
+        print(f"❌ Could not store rows for {table_ref}: {e}")
+        return False
+
+    print(f"✅ Inserted {len(rows) - quarantined} rows into {table_ref}")
+    return True
+
+# Route rows to the configured sink. The file sink holds the acks of the
+# messages the rows came from until the file they are in is closed
+def write_rows(rows, table_ref, acks=()) -> bool:
+    if not rows:
+        return True
+
+    if file_sink is not None:
+        try:
+            file_sink.write(rows, table_ref.rsplit(".", 1)[-1], acks)
+        except Exception as e:
+            print(f"❌ Could not write rows for {table_ref} to the file sink: {e}")
+            return False
+        return True
+    return insert_to_bq(rows, table_ref)
+
+
+def file_sink_roller():
+    while True:
+        time.sleep(min(FILE_SINK_MAX_AGE_SECONDS, 10))
+        try:
+            file_sink.roll_expired()
+        except Exception as e:
+            print(f"❌ File sink roll failed: {e}")
+
+# Write closed rollup windows, then release the messages they covered
+def flush_rollup(force=False):
+    rows, acks = rollup.flush(force=force)
+    ok = write_rows(rows, BQ_TABLE_ROLLUP, acks)
+    for ack in acks:
+        ack.release(ok)
+
+
+def rollup_flusher():
+    while True:
+        time.sleep(ROLLUP_FLUSH_INTERVAL)
+        try:
+            flush_rollup()
+        except Exception as e:
+            print(f"❌ Rollup flush failed: {e}")
 
 # Pub/Sub callback
 def callback(message):
     print(f"📥 Received message: {message.data}")
-    metric_rows, log_rows = parse_message(message.data.decode("utf-8"))
+    metric_rows, log_rows = parse_message(message.data, message.attributes)
+    ack = PendingAck(message)
+
+    # Nack on failure so Pub/Sub redelivers instead of silently dropping rows
+    if not write_rows(log_rows, BQ_TABLE_LOGS, [ack]):
+        ack.release(False)
+        return
 
-    if metric_rows:
-        insert_to_bq(metric_rows, BQ_TABLE_METRICS)
-    if log_rows:
-        insert_to_bq(log_rows, BQ_TABLE_LOGS)
+    if metric_rows and rollup is not None:
+        # Ack is deferred until every window this message fed has been
+        # written, and becomes a nack if any of those writes failed
+        rollup.add(metric_rows, ack)
+        ack.release()
+        return
 
-    message.ack()
+    ack.release(write_rows(metric_rows, BQ_TABLE_METRICS, [ack]))
 
 def main():
     subscriber = pubsub_v1.SubscriberClient()
     subscription_path = subscriber.subscription_path(PROJECT_ID, SUBSCRIPTION_ID)
 
-    streaming_pull_future = subscriber.subscribe(subscription_path, callback=callback)
+    if file_sink is not None:
+        file_sink.recover()
+        threading.Thread(target=file_sink_roller, daemon=True).start()
+        print(f"🗂️ Writing rolling Parquet files under {FILE_SINK_DIR} ({FILE_SINK_UPLOADER} uploader)")
+
+    if rollup is not None:
+        threading.Thread(target=rollup_flusher, daemon=True).start()
+        print(f"🧮 Rolling up metrics into {ROLLUP_WINDOW_SECONDS}s windows -> {BQ_TABLE_ROLLUP}")
+
+    flow_control = pubsub_v1.types.FlowControl(max_messages=MAX_OUTSTANDING_MESSAGES)
+    streaming_pull_future = subscriber.subscribe(subscription_path, callback=callback, flow_control=flow_control)
     print(f"🚀 Listening for messages on {subscription_path}...")
 
     try:
         streaming_pull_future.result()
     except KeyboardInterrupt:
         streaming_pull_future.cancel()
+        if rollup is not None:
+            flush_rollup(force=True)
+        if file_sink is not None:
+            file_sink.close()
 
 if __name__ == "__main__":
     main()
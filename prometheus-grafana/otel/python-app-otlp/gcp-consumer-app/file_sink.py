@@ -0,0 +1,350 @@
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+IN_PROGRESS_SUFFIX = ".inprogress"
+# Files that kept failing to upload are parked here (not picked up by recover())
+FAILED_DIR = "failed"
+
+
+# --- Uploaders ---
+# An uploader is any callable(path, table, partition) that takes ownership of
+# a closed Parquet file. It should raise on failure so the file is kept.
+class LocalDirectoryUploader:
+    """Move closed files into another directory (keeps the table/date layout)."""
+
+    def __init__(self, target_dir: str):
+        self.target_dir = target_dir
+
+    def __call__(self, path, table, partition):
+        dest_dir = os.path.join(self.target_dir, table, partition)
+        os.makedirs(dest_dir, exist_ok=True)
+        shutil.move(path, os.path.join(dest_dir, os.path.basename(path)))
+
+
+class BigQueryLoadUploader:
+    """Append closed files to BigQuery with a (free) batch load job."""
+
+    def __init__(self, client, table_refs: dict):
+        from google.cloud import bigquery
+
+        self.client = client
+        self.table_refs = table_refs
+        self.job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        )
+
+    def __call__(self, path, table, partition):
+        with open(path, "rb") as f:
+            job = self.client.load_table_from_file(f, self.table_refs[table], job_config=self.job_config)
+        job.result()
+        os.remove(path)
+
+
+# --- Helpers ---
+def _partition_for(row) -> str:
+    ts = row.get("timestamp")
+    if isinstance(ts, str) and len(ts) >= 10 and ts[4] == "-" and ts[7] == "-":
+        return f"dt={ts[:10]}"
+    return f"dt={datetime.now(timezone.utc).strftime('%Y-%m-%d')}"
+
+
+def _json_cells(row):
+    """
+    Dict cells (native attributes/resource) as JSON strings: a Parquet struct
+    would only keep the keys seen in a file's first rows, and BigQuery loads
+    strings into JSON columns.
+    """
+    if not any(isinstance(value, dict) for value in row.values()):
+        return row
+    return {k: json.dumps(v) if isinstance(v, dict) else v for k, v in row.items()}
+
+
+def _parse_ts(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _infer_schema(rows) -> pa.Schema:
+    """Infer a file schema; timestamp is TIMESTAMP, all-null columns STRING/FLOAT."""
+    inferred = pa.Table.from_pylist(rows).schema
+    fields = []
+    for field in inferred:
+        if field.name == "timestamp":
+            field = pa.field("timestamp", pa.timestamp("us", tz="UTC"))
+        elif pa.types.is_null(field.type):
+            field = pa.field(field.name, pa.float64() if field.name.startswith("value") else pa.string())
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _to_table(rows, schema) -> pa.Table:
+    return pa.Table.from_pylist(rows, schema=schema)
+
+
+class _OpenFile:
+    def __init__(self, path, schema, acks=()):
+        self.path = path
+        self.schema = schema
+        self.sink = pa.OSFile(path, "wb")
+        self.writer = pq.ParquetWriter(self.sink, schema, compression="zstd")
+        self.opened_at = time.monotonic()
+        self.buffer = []
+        self.acks = list(acks)  # PendingAcks with rows in this file
+        self.rows = 0  # rows written so far (the buffer not included)
+
+    def size(self):
+        return self.sink.tell()
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+# --- Sink ---
+class RollingParquetSink:
+    """
+    Write rows into rolling Parquet files under <directory>/<table>/dt=<date>/.
+
+    A file is closed once it reaches max_bytes or has been open for
+    max_age_seconds. Rows stay in memory or in an unfinished file until then,
+    so the PendingAcks passed to write() are held until the file is closed,
+    synced to disk and renamed, and released as failed if writing it fails.
+
+    Once the open files hold max_held_acks acks between them they are all
+    closed early, so Pub/Sub flow control (which counts un-acked messages)
+    does not stall the subscriber until max_age_seconds is reached.
+
+    Rows whose timestamp cannot be parsed are passed to quarantine(rejected,
+    table) as (row, errors) pairs instead of being written, so every file has
+    a TIMESTAMP column.
+
+    Closed files are handed to the uploader on a background thread. Failed
+    uploads are retried with exponential backoff; after upload_max_attempts
+    a file is moved to <directory>/failed/ for inspection. Files still on
+    disk at the next start are picked up by recover().
+    """
+
+    def __init__(self, directory: str, uploader, max_bytes: int = 128 * 1024 * 1024,
+                 max_age_seconds: float = 300, row_group_rows: int = 10000,
+                 upload_backoff_seconds: float = 5.0, upload_backoff_max_seconds: float = 300.0,
+                 upload_max_attempts: int = 10, quarantine=None, max_held_acks: int = None):
+        self.directory = directory
+        self.uploader = uploader
+        self.upload_max_attempts = upload_max_attempts
+        self.quarantine = quarantine
+        self.max_held_acks = max_held_acks
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.row_group_rows = row_group_rows
+        self.upload_backoff_seconds = upload_backoff_seconds
+        self.upload_backoff_max_seconds = upload_backoff_max_seconds
+
+        self._files = {}  # (table, partition) -> _OpenFile
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._uploads = queue.Queue()
+        threading.Thread(target=self._upload_worker, daemon=True).start()
+
+    def write(self, rows, table: str, acks=()):
+        """
+        Buffer rows for table; row groups are written every row_group_rows.
+        Each ack is held until every file these rows went into is closed.
+        """
+        by_partition, rejected = {}, []
+        for row in rows:
+            try:
+                ts = _parse_ts(row.get("timestamp"))
+            except (TypeError, ValueError, AttributeError) as e:
+                rejected.append((row, [{"reason": "invalid", "message": f"Unparseable timestamp: {e}"}]))
+                continue
+            by_partition.setdefault(_partition_for(row), []).append(dict(_json_cells(row), timestamp=ts))
+
+        if rejected:
+            if self.quarantine is None:
+                print(f"❌ Dropping {len(rejected)} {table} rows with an unparseable timestamp")
+            else:
+                self.quarantine(rejected, table)
+
+        with self._lock:
+            for partition, part_rows in by_partition.items():
+                key = (table, partition)
+                open_file = self._files.get(key) or self._open(key, part_rows)
+                open_file.buffer.extend(part_rows)
+                for ack in acks:
+                    ack.hold()
+                    open_file.acks.append(ack)
+                if len(open_file.buffer) >= self.row_group_rows:
+                    self._write_buffer(key, open_file)
+
+            if self.max_held_acks and sum(len(f.acks) for f in self._files.values()) >= self.max_held_acks:
+                print(f"🗂️ {self.max_held_acks} messages waiting on open files, rolling them")
+                while self._files:
+                    self._close(next(iter(self._files)))
+
+    def roll_expired(self):
+        """Close files that are over their age limit."""
+        now = time.monotonic()
+        with self._lock:
+            for key, open_file in list(self._files.items()):
+                if now - open_file.opened_at >= self.max_age_seconds:
+                    self._close(key)
+
+    def close(self):
+        """Close every open file and wait for uploads (not for scheduled retries)."""
+        with self._lock:
+            while self._files:
+                self._close(next(iter(self._files)))
+        self._uploads.join()
+
+    def recover(self):
+        """
+        Queue closed files left on disk by a previous run for upload, and
+        delete unfinished ones: their messages were never acked, so Pub/Sub
+        redelivers those rows.
+        """
+        for root, dirs, names in os.walk(self.directory):
+            if root == self.directory and FAILED_DIR in dirs:
+                dirs.remove(FAILED_DIR)
+            for name in names:
+                path = os.path.join(root, name)
+                if name.endswith(".parquet"):
+                    table_dir, partition = os.path.split(os.path.relpath(root, self.directory))
+                    self._uploads.put((path, table_dir, partition, 0))
+                elif name.endswith(IN_PROGRESS_SUFFIX):
+                    os.remove(path)
+                    print(f"🗑️ Removed unfinished file {path}")
+
+    def _open(self, key, rows, acks=()):
+        table, partition = key
+        part_dir = os.path.join(self.directory, table, partition)
+        os.makedirs(part_dir, exist_ok=True)
+        self._seq += 1
+        name = f"{table}-{int(time.time() * 1000)}-{os.getpid()}-{self._seq}.parquet"
+        open_file = _OpenFile(os.path.join(part_dir, name + IN_PROGRESS_SUFFIX), _infer_schema(rows), acks)
+        self._files[key] = open_file
+        return open_file
+
+    def _write_buffer(self, key, open_file):
+        rows, open_file.buffer = open_file.buffer, []
+        try:
+            batch = _to_table(rows, open_file.schema)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError):
+            # Rows no longer fit this file's schema: start a new file for
+            # them. Any of the old file's acks may own these rows, so the new
+            # file takes references before the old one gives its back
+            acks = list(open_file.acks)
+            for ack in acks:
+                ack.hold()
+            self._close(key)
+            try:
+                open_file = self._open(key, rows, acks)
+            except Exception as e:
+                print(f"❌ Could not open a new {key[0]} file, its messages will be redelivered: {e}")
+                for ack in acks:
+                    ack.release(False)
+                return
+            batch = None
+
+        try:
+            if batch is None:
+                batch = _to_table(rows, open_file.schema)
+            open_file.writer.write_table(batch)
+            open_file.rows += batch.num_rows
+        except Exception as e:
+            self._discard(key, open_file, e)
+            return
+
+        if open_file.size() >= self.max_bytes:
+            self._close(key)
+
+    def _close(self, key):
+        open_file = self._files[key]
+        if open_file.buffer:
+            self._write_buffer(key, open_file)
+            if self._files.get(key) is not open_file:
+                # _write_buffer already rolled this file
+                return
+        try:
+            open_file.close()
+            final_path = open_file.path[: -len(IN_PROGRESS_SUFFIX)]
+            os.rename(open_file.path, final_path)
+            _fsync_dir(os.path.dirname(final_path))
+        except Exception as e:
+            self._discard(key, open_file, e)
+            return
+        del self._files[key]
+
+        # The rows are on disk now and recover() would upload them after a crash
+        for ack in open_file.acks:
+            ack.release()
+        if not open_file.rows:
+            # e.g. a file whose buffered rows moved to a file with a new schema
+            os.remove(final_path)
+            return
+        self._uploads.put((final_path, key[0], key[1], 0))
+
+    def _discard(self, key, open_file, error):
+        """Drop a file that could not be written and fail its acks."""
+        print(f"❌ Writing {open_file.path} failed, its messages will be redelivered: {error}")
+        if self._files.get(key) is open_file:
+            del self._files[key]
+        try:
+            open_file.close()
+        except Exception:
+            pass
+        try:
+            os.remove(open_file.path)
+        except OSError:
+            pass
+        for ack in open_file.acks:
+            ack.release(False)
+
+    def _upload_worker(self):
+        while True:
+            path, table, partition, attempt = self._uploads.get()
+            try:
+                self.uploader(path, table, partition)
+                print(f"✅ Uploaded {path}")
+            except Exception as e:
+                if attempt + 1 >= self.upload_max_attempts:
+                    self._park_failed(path, table, partition, e)
+                    continue
+                delay = min(self.upload_backoff_max_seconds, self.upload_backoff_seconds * 2 ** attempt)
+                print(f"❌ Upload of {path} failed, retrying in {delay:.1f}s: {e}")
+                retry = threading.Timer(delay, self._uploads.put, args=((path, table, partition, attempt + 1),))
+                retry.daemon = True
+                retry.start()
+            finally:
+                self._uploads.task_done()
+
+    def _park_failed(self, path, table, partition, error):
+        failed_dir = os.path.join(self.directory, FAILED_DIR, table, partition)
+        try:
+            os.makedirs(failed_dir, exist_ok=True)
+            shutil.move(path, os.path.join(failed_dir, os.path.basename(path)))
+            print(f"☣️ Upload of {path} failed {self.upload_max_attempts} times, moved to {failed_dir}: {error}")
+        except OSError as e:
+            print(f"❌ Could not move {path} to {failed_dir}: {e}")
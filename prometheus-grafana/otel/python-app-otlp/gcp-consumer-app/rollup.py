@@ -0,0 +1,144 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone
+
+# Aggregations a rollup row can carry (one "value_<agg>" column each)
+AGGREGATIONS = ("count", "sum", "min", "max", "last")
+
+
+def _attr_key(attributes) -> str:
+    """Stable grouping key for attributes (JSON string, dict or key/value list)."""
+    if isinstance(attributes, str):
+        return attributes
+    return json.dumps(attributes or {}, sort_keys=True, separators=(",", ":"))
+
+
+def _to_epoch(ts) -> float:
+    """Parse a BigQuery TIMESTAMP string produced by parse_message."""
+    return datetime.fromisoformat(ts.replace("Z", "+00:00")).timestamp()
+
+
+def _to_bq_ts(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class _Window:
+    __slots__ = ("row", "count", "sum", "min", "max", "last", "last_ts", "acks")
+
+    def __init__(self, row):
+        self.row = row
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.last = None
+        self.last_ts = None
+        self.acks = []
+
+    def add(self, value, ts):
+        self.count += 1
+        if value is None:
+            return
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if self.last_ts is None or ts >= self.last_ts:
+            self.last, self.last_ts = value, ts
+
+
+class MetricRollup:
+    """
+    Aggregate metric rows per (store_id, metric_name, attributes) into
+    fixed event-time windows and emit one row per window.
+
+    Each PendingAck handed to add() is held once per window its rows went
+    into. flush() returns the acks of the windows it emitted, and the caller
+    releases them with the outcome of writing those rows, so a message is
+    acked only when all of its windows were written and nacked if any failed.
+    """
+
+    def __init__(self, window_seconds: int, aggregations=AGGREGATIONS,
+                 value_agg: str = "last", grace_seconds: float = 30.0):
+        unknown = set(aggregations) - set(AGGREGATIONS)
+        if unknown:
+            raise ValueError(f"Unknown rollup aggregations: {sorted(unknown)}")
+        if value_agg not in AGGREGATIONS:
+            raise ValueError(f"Unknown rollup value aggregation: {value_agg}")
+
+        self.window_seconds = window_seconds
+        self.aggregations = tuple(aggregations)
+        self.value_agg = value_agg
+        self.grace_seconds = grace_seconds
+
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def add(self, rows, ack=None):
+        """Fold parsed metric rows into their windows."""
+        with self._lock:
+            touched = set()
+            for row in rows:
+                ts = _to_epoch(row["timestamp"])
+                start = ts - (ts % self.window_seconds)
+                key = (row.get("store_id"), row.get("metric_name"), _attr_key(row.get("attributes")), start)
+
+                window = self._windows.get(key)
+                if window is None:
+                    window = self._windows[key] = _Window(row)
+                window.row = row  # keep the latest resource for the window
+                window.add(row.get("value"), ts)
+                touched.add(key)
+
+            if ack is None:
+                return
+            for key in touched:
+                self._windows[key].acks.append(ack)
+                ack.hold()
+
+    def flush(self, now: float = None, force: bool = False):
+        """
+        Emit closed windows (end + grace <= now, or all of them when forced).
+
+        Returns (rows, acks): release every ack with whether rows were
+        written (an ack appears once per emitted window it held).
+        """
+        now = time.time() if now is None else now
+        rows, acks = [], []
+
+        with self._lock:
+            closed = [
+                key for key in self._windows
+                if force or key[3] + self.window_seconds + self.grace_seconds <= now
+            ]
+            for key in closed:
+                window = self._windows.pop(key)
+                rows.append(self._to_row(key[3], window))
+                acks.extend(window.acks)
+
+        return rows, acks
+
+    def _to_row(self, start, window):
+        values = {
+            "count": window.count,
+            "sum": window.sum if window.min is not None else None,
+            "min": window.min,
+            "max": window.max,
+            "last": window.last,
+        }
+        row = {
+            "store_id": window.row.get("store_id"),
+            "metric_name": window.row.get("metric_name"),
+            "timestamp": _to_bq_ts(start),
+            "window_seconds": self.window_seconds,
+            "value": values[self.value_agg],
+            "attributes": window.row.get("attributes", "{}"),
+            "resource": window.row.get("resource", "{}"),
+        }
+        for agg in self.aggregations:
+            row[f"value_{agg}"] = values[agg]
+        return row
+
+    def __len__(self):
+        with self._lock:
+            return len(self._windows)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Compare /log (one event per request) with /log/bulk (many events per request)
+on a running poc_metric_transform.py.
+
+    python bench_log_ingest.py --url http://localhost:5000 --events 5000 --batch-size 200
+"""
+import argparse
+import random
+import time
+
+import requests
+
+
+def make_event(i: int) -> dict:
+    return {
+        "app_info": f"bench-app-{i % 5}",
+        "message_id": "LOG_ERROR",
+        "event": random.choice(["CAM_DISCONNECTED", "CAM_TIMEOUT"]),
+        "event_value": f"camera id: {i % 50}",
+    }
+
+
+def bench_single(session, url, events):
+    start = time.perf_counter()
+    for event in events:
+        session.post(f"{url}/log", json=event).raise_for_status()
+    return time.perf_counter() - start
+
+
+def bench_bulk(session, url, events, batch_size):
+    start = time.perf_counter()
+    for i in range(0, len(events), batch_size):
+        session.post(f"{url}/log/bulk", json=events[i:i + batch_size]).raise_for_status()
+    return time.perf_counter() - start
+
+
+def report(name, n_events, n_requests, elapsed):
+    print(f"{name:<8} {n_events:>8} events {n_requests:>7} requests "
+          f"{elapsed:8.2f}s {n_events / elapsed:12.0f} events/s "
+          f"{elapsed / n_events * 1e6:10.1f} us/event")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args()
+
+    events = [make_event(i) for i in range(args.events)]
+
+    # Keep-alive session for both runs so only the endpoints differ
+    with requests.Session() as session:
+        # warm up connection and code paths
+        bench_single(session, args.url, events[:50])
+        bench_bulk(session, args.url, events[:50], args.batch_size)
+
+        single = bench_single(session, args.url, events)
+        bulk = bench_bulk(session, args.url, events, args.batch_size)
+
+    n_batches = -(-args.events // args.batch_size)
+    report("single", args.events, args.events, single)
+    report("bulk", args.events, n_batches, bulk)
+    print(f"speedup  {single / bulk:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
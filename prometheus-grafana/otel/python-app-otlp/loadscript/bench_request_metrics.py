@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Measure the per-request overhead of RequestMetricsMiddleware by driving a
+trivial ASGI app directly (no server, no network), with and without it, and
+exit with status 1 if it is over budget.
+
+The agreed budget is 5 us per request in both modes; --multiprocess runs
+with a temporary PROMETHEUS_MULTIPROC_DIR, like WORKERS > 1 does. Each
+round times the bare app and the middleware back to back, and the
+median overhead over --rounds rounds is compared, so one noisy round does
+not decide the check. The host is printed with the result, since the
+numbers only compare on the same machine.
+
+Reference host: 1 vCPU x86_64 Intel Xeon VM, Linux 6.18, Python 3.11.7,
+default arguments. Idle (bare ~0.8 us/request), the median overhead is
+3.2-4.2 us in both modes. When the VM is contended, the bare app slows to
+~1.3 us/request and the overhead to 4.9-5.5 us. Compare runs with a
+similar bare figure.
+
+    python bench_request_metrics.py --requests 200000
+    python bench_request_metrics.py --multiprocess --budget-us 5
+"""
+import argparse
+import asyncio
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+
+class _Route:
+    path = "/log"
+
+
+async def plain_app(scope, receive, send):
+    scope["route"] = _Route
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b'{"status":"success"}'})
+
+
+def build_middleware(multiprocess: bool):
+    """
+    Same collectors poc_metric_transform.py picks for the given mode, plus
+    the flusher that writes them to the metric files (None in single-process mode).
+    """
+    # Imported here: prometheus_client picks its value class on import
+    from prometheus_client import CollectorRegistry, Gauge, Histogram
+    from metric_recorder import BufferedGauge, BufferedHistogram, LoopGauge, PeriodicFlusher, ShardedHistogram
+    from request_metrics import RequestMetricsMiddleware
+
+    registry = CollectorRegistry()
+    labels = ["route", "method", "status"]
+
+    def histogram(name):
+        if multiprocess:
+            return BufferedHistogram(Histogram(name, "", labels, registry=registry), labels, Histogram.DEFAULT_BUCKETS)
+        return ShardedHistogram(name, "", labels, Histogram.DEFAULT_BUCKETS, registry=registry)
+
+    if multiprocess:
+        in_flight = BufferedGauge(Gauge("in_flight", "", registry=registry, multiprocess_mode="livesum"))
+    else:
+        in_flight = LoopGauge("in_flight", "", registry=registry)
+
+    middleware = RequestMetricsMiddleware(
+        plain_app,
+        latency=histogram("latency_ms"),
+        request_size=histogram("request_bytes"),
+        response_size=histogram("response_bytes"),
+        in_flight=in_flight,
+    )
+    flusher = None
+    if multiprocess:
+        flusher = PeriodicFlusher([middleware.latency, middleware.request_size, middleware.response_size, in_flight])
+    return middleware, flusher
+
+
+def host_description():
+    model = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo") as f:
+            model = next(line.split(":", 1)[1].strip() for line in f if line.startswith("model name"))
+    except (OSError, StopIteration):
+        pass
+    return f"{model}, {os.cpu_count()} CPU(s), Python {platform.python_version()} on {platform.platform()}"
+
+
+async def drive(app, n):
+    headers = [(b"content-type", b"application/json"), (b"content-length", b"120")]
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(n):
+        await app({"type": "http", "method": "POST", "path": "/log", "headers": headers}, receive, send)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200000)
+    parser.add_argument("--multiprocess", action="store_true",
+                        help="use the collectors chosen when WORKERS > 1, backed by a temporary multiproc dir")
+    parser.add_argument("--rounds", type=int, default=9, help="the median overhead over these rounds is reported")
+    parser.add_argument("--budget-us", type=float, default=5.0, help="maximum overhead per request")
+    args = parser.parse_args()
+
+    if args.multiprocess:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="bench_multiproc_")
+    sys.path.insert(0, APP_DIR)
+
+    middleware, flusher = build_middleware(args.multiprocess)
+    asyncio.run(drive(middleware, 1000))  # warm up / bind children
+
+    bare, wrapped = [], []
+    for i in range(args.rounds):
+        # Alternate which one runs first, so drift within a round evens out
+        for app, times in ((plain_app, bare), (middleware, wrapped))[::1 if i % 2 else -1]:
+            times.append(asyncio.run(drive(app, args.requests)) / args.requests * 1e6)
+    overheads = [w - b for b, w in zip(bare, wrapped)]
+    overhead_us = statistics.median(overheads)
+
+    print(f"host        {host_description()}")
+    print(f"bare        {statistics.median(bare):8.2f} us/request (median)")
+    print(f"middleware  {statistics.median(wrapped):8.2f} us/request (median)")
+    print(f"overhead    {overhead_us:8.2f} us/request (median of {args.rounds}, "
+          f"min {min(overheads):.2f}, max {max(overheads):.2f}, budget {args.budget_us:.2f})")
+
+    if flusher is not None:
+        # Runs once per flush interval on a background thread, not per request
+        start = time.perf_counter()
+        flusher.flush()
+        print(f"flush       {(time.perf_counter() - start) * 1000:8.2f} ms")
+
+    if overhead_us > args.budget_us:
+        print(f"❌ Middleware overhead {overhead_us:.2f} us/request is over the {args.budget_us:.2f} us budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
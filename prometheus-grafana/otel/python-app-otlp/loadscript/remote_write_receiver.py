@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Stand-in Prometheus remote-write receiver for trying the push mode of
+poc_metric_transform.py without VictoriaMetrics/Prometheus. Decodes each
+snappy/protobuf WriteRequest and prints the samples.
+
+    python remote_write_receiver.py --port 8428 --fail-every 3
+    REMOTE_WRITE_URL=http://localhost:8428/api/v1/write python poc_metric_transform.py
+
+--fail-every N answers every Nth request with 503 to exercise retries.
+"""
+import argparse
+import os
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import snappy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from remote_write import decode_write_request  # noqa: E402
+
+
+class Handler(BaseHTTPRequestHandler):
+    fail_every = 0
+    quiet = False
+    requests_seen = 0
+    samples_seen = 0
+
+    def do_POST(self):
+        cls = type(self)
+        cls.requests_seen += 1
+        if cls.fail_every and cls.requests_seen % cls.fail_every == 0:
+            self.send_response(503)
+            self.end_headers()
+            print(f"❌ request {cls.requests_seen}: answered 503")
+            return
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            series = decode_write_request(snappy.decompress(body))
+        except Exception as e:
+            self.send_response(400)
+            self.end_headers()
+            self.wfile.write(str(e).encode())
+            return
+
+        cls.samples_seen += sum(len(samples) for _, samples in series)
+        print(f"📥 request {cls.requests_seen}: {len(series)} series ({len(body)} bytes), "
+              f"{cls.samples_seen} samples so far")
+        if not cls.quiet:
+            for labels, samples in series:
+                name = labels.pop("__name__", "")
+                label_text = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+                for value, timestamp in samples:
+                    print(f"   {name}{{{label_text}}} {value} {timestamp}")
+
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8428)
+    parser.add_argument("--fail-every", type=int, default=0)
+    parser.add_argument("--quiet", action="store_true", help="print one line per request only")
+    args = parser.parse_args()
+
+    Handler.fail_every = args.fail_every
+    Handler.quiet = args.quiet
+    print(f"🚀 Remote-write receiver on :{args.port}/api/v1/write")
+    ThreadingHTTPServer(("0.0.0.0", args.port), Handler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
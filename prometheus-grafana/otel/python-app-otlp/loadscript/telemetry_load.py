@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Synthetic OTLP load for sizing the collector -> RabbitMQ -> bridge -> Pub/Sub
+pipeline. Worker processes each emit their share of the target rates through
+the OTel SDK (OTLP/HTTP, like metrics_generator.py) and report what they
+actually recorded and exported.
+
+    python telemetry_load.py --processes 4 --measurements-per-sec 20000 \\
+        --logs-per-sec 2000 --series 500 --profile zipf --duration 60
+
+Metric measurements are aggregated in the SDK, so the collector receives
+(series x metrics) data points per export interval, not one per measurement;
+both numbers are reported. Profiles:
+  uniform  every series equally likely
+  zipf     a few hot series, a long tail (typical real traffic)
+  churn    a fresh set of --series series every --churn-seconds
+"""
+import argparse
+import logging
+import multiprocessing
+import random
+import time
+
+# Length of one pacing step; each step emits whatever the target rate is behind by
+TICK_SECONDS = 0.01
+# Never emit more than this many steps' worth at once after a stall
+MAX_CATCH_UP_TICKS = 10
+
+
+def series_picker(profile: str, series: int, churn_seconds: float):
+    """Returns pick(k, now) -> list of k series ids."""
+    if profile == "zipf":
+        weights = [1 / (rank + 1) for rank in range(series)]
+        ids = list(range(series))
+        return lambda k, now: random.choices(ids, weights, k=k)
+    if profile == "churn":
+        def pick(k, now):
+            base = int(now // churn_seconds) * series
+            return [base + random.randrange(series) for _ in range(k)]
+        return pick
+    return lambda k, now: [random.randrange(series) for _ in range(k)]
+
+
+def worker(index: int, args, results):
+    # Everything OTel is created in the child so each process has its own
+    # providers, exporters and export threads
+    from opentelemetry.exporter.otlp.proto.http._log_exporter import OTLPLogExporter
+    from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+    from opentelemetry.sdk._logs import LoggerProvider, LoggingHandler
+    from opentelemetry.sdk._logs.export import BatchLogRecordProcessor
+    from opentelemetry.sdk.metrics import MeterProvider
+    from opentelemetry.sdk.metrics.export import MetricExportResult, PeriodicExportingMetricReader
+    from opentelemetry.sdk.resources import Resource
+
+    stats = {"measurements": 0, "logs": 0, "exported_points": 0, "exported_logs": 0,
+             "export_failures": 0, "max_lag": 0.0}
+
+    class CountingMetricExporter(OTLPMetricExporter):
+        def export(self, metrics_data, timeout_millis: float = 10_000, **kwargs):
+            result = super().export(metrics_data, timeout_millis=timeout_millis, **kwargs)
+            if result is MetricExportResult.SUCCESS:
+                stats["exported_points"] += sum(
+                    len(metric.data.data_points)
+                    for rm in metrics_data.resource_metrics
+                    for sm in rm.scope_metrics
+                    for metric in sm.metrics
+                )
+            else:
+                stats["export_failures"] += 1
+            return result
+
+    class CountingLogExporter(OTLPLogExporter):
+        def export(self, batch, *args, **kwargs):
+            result = super().export(batch, *args, **kwargs)
+            # The result enum was renamed across SDK versions
+            if result.name == "SUCCESS":
+                stats["exported_logs"] += len(batch)
+            else:
+                stats["export_failures"] += 1
+            return result
+
+    resource = Resource(attributes={
+        "service.name": "telemetry-load",
+        "service.instance.id": f"loadgen-{index}",
+        "environment": "load-test",
+    })
+
+    reader = PeriodicExportingMetricReader(
+        CountingMetricExporter(endpoint=f"{args.endpoint}/v1/metrics"),
+        export_interval_millis=args.export_interval_ms,
+    )
+    meter_provider = MeterProvider(resource=resource, metric_readers=[reader])
+    meter = meter_provider.get_meter("telemetry.load")
+    counters = [meter.create_counter(f"loadgen_metric_{i}_total") for i in range(args.metrics)]
+
+    logger_provider = LoggerProvider(resource=resource)
+    logger_provider.add_log_record_processor(BatchLogRecordProcessor(
+        CountingLogExporter(endpoint=f"{args.endpoint}/v1/logs"),
+        max_queue_size=args.log_queue_size,
+    ))
+    logger = logging.getLogger(f"telemetry-load-{index}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(LoggingHandler(level=logging.INFO, logger_provider=logger_provider))
+
+    pick = series_picker(args.profile, args.series, args.churn_seconds)
+    # Attribute dicts are built once per series id and reused
+    attribute_cache = {}
+
+    def attributes(series_id):
+        attrs = attribute_cache.get(series_id)
+        if attrs is None:
+            attrs = attribute_cache[series_id] = {"series": str(series_id), "app_info": f"loadgen-app-{series_id % 50}"}
+        return attrs
+
+    measurement_rate = args.measurements_per_sec / args.processes
+    log_rate = args.logs_per_sec / args.processes
+    start = time.perf_counter()
+    deadline = start + args.duration
+    next_tick = start
+
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        elapsed = now - start
+        stats["max_lag"] = max(stats["max_lag"], now - next_tick)
+
+        due = int(elapsed * measurement_rate) - stats["measurements"]
+        due = min(due, int(measurement_rate * TICK_SECONDS * MAX_CATCH_UP_TICKS) + 1)
+        if due > 0:
+            for series_id in pick(due, elapsed):
+                random.choice(counters).add(1, attributes(series_id))
+            stats["measurements"] += due
+
+        due = int(elapsed * log_rate) - stats["logs"]
+        due = min(due, int(log_rate * TICK_SECONDS * MAX_CATCH_UP_TICKS) + 1)
+        if due > 0:
+            for series_id in pick(due, elapsed):
+                logger.error(f"camera id: {series_id}", extra={
+                    "message_id": "LOG_ERROR",
+                    "event": "CAM_DISCONNECTED",
+                    "app_info": attributes(series_id)["app_info"],
+                })
+            stats["logs"] += due
+
+        next_tick += TICK_SECONDS
+        if next_tick > now:
+            time.sleep(next_tick - now)
+        else:
+            next_tick = now  # behind: don't try to replay missed ticks
+
+    stats["elapsed"] = time.perf_counter() - start
+    # Final export so everything recorded is counted
+    meter_provider.shutdown()
+    logger_provider.shutdown()
+    stats["series_seen"] = len(attribute_cache)
+    results.put((index, stats))
+
+
+def report(args, results):
+    print(f"{'proc':>4} {'meas/s':>10} {'logs/s':>9} {'points/s':>9} {'exp logs/s':>10} "
+          f"{'failures':>8} {'series':>7} {'max lag':>8}")
+    total = {"measurements": 0, "logs": 0, "exported_points": 0, "exported_logs": 0, "export_failures": 0}
+    for index, stats in sorted(results):
+        elapsed = stats["elapsed"]
+        for key in total:
+            total[key] += stats[key]
+        print(f"{index:>4} {stats['measurements'] / elapsed:>10.0f} {stats['logs'] / elapsed:>9.0f} "
+              f"{stats['exported_points'] / elapsed:>9.0f} {stats['exported_logs'] / elapsed:>10.0f} "
+              f"{stats['export_failures']:>8} {stats['series_seen']:>7} {stats['max_lag'] * 1000:>6.0f}ms")
+
+    elapsed = max(stats["elapsed"] for _, stats in results)
+    achieved = total["measurements"] / elapsed / args.measurements_per_sec if args.measurements_per_sec else 1
+    achieved_logs = total["logs"] / elapsed / args.logs_per_sec if args.logs_per_sec else 1
+    print(f"total {total['measurements'] / elapsed:>9.0f} {total['logs'] / elapsed:>9.0f} "
+          f"{total['exported_points'] / elapsed:>9.0f} {total['exported_logs'] / elapsed:>10.0f} "
+          f"{total['export_failures']:>8}")
+    print(f"achieved {achieved:.0%} of target measurements, {achieved_logs:.0%} of target logs")
+    if total["logs"] > total["exported_logs"]:
+        print(f"⚠️  {total['logs'] - total['exported_logs']} log records were not exported "
+              f"(queue full or export failed)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", default="http://otel-collector:4318")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--measurements-per-sec", type=float, default=10000)
+    parser.add_argument("--logs-per-sec", type=float, default=1000)
+    parser.add_argument("--metrics", type=int, default=5, help="number of counter instruments")
+    parser.add_argument("--series", type=int, default=100, help="distinct attribute sets per process")
+    parser.add_argument("--profile", choices=["uniform", "zipf", "churn"], default="uniform")
+    parser.add_argument("--churn-seconds", type=float, default=10)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--export-interval-ms", type=int, default=5000)
+    parser.add_argument("--log-queue-size", type=int, default=20480)
+    args = parser.parse_args()
+
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker, args=(i, args, results))
+        for i in range(args.processes)
+    ]
+    print(f"🚀 {args.processes} processes, target {args.measurements_per_sec:.0f} measurements/s, "
+          f"{args.logs_per_sec:.0f} logs/s, {args.series} series ({args.profile}) for {args.duration:.0f}s")
+    for process in processes:
+        process.start()
+    # Read before join: a child blocks on exit until its queued result is consumed
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    report(args, collected)
+
+
+if __name__ == "__main__":
+    main()